@@ -1,7 +1,3 @@
-import bpy
-
-from .operators import OPERATOR_CLASSES, BH_OT_NupImport, BH_OT_PakImport
-
 bl_info = {
     "name": "Bionicle:Heroes toolkit",
     "author": "REDxEYE,",
@@ -11,24 +7,29 @@ bl_info = {
     "category": "Import-Export"
 }
 
+try:
+    import bpy
+except ImportError:
+    # Imported outside of Blender by command line tools (python -m BionicleHeroesTools)
+    bpy = None
 
-ALL_CLASSES = OPERATOR_CLASSES  # + UI_CLASSES
-
-register_, unregister_ = bpy.utils.register_classes_factory(ALL_CLASSES)
-
+if bpy is not None:
+    from .operators import OPERATOR_CLASSES, BH_OT_NupImport, BH_OT_PakImport
 
-def menu_import(self, context):
-    self.layout.operator(BH_OT_NupImport.bl_idname, text="Bionicle Model (.nup/.hgp)")
-    self.layout.operator(BH_OT_PakImport.bl_idname, text="Bionicle Pak file (.pak)")
+    ALL_CLASSES = OPERATOR_CLASSES  # + UI_CLASSES
 
+    register_, unregister_ = bpy.utils.register_classes_factory(ALL_CLASSES)
 
-def register():
-    register_()
-    bpy.types.TOPBAR_MT_file_import.append(menu_import)
-    # bpy.types.TOPBAR_MT_file_export.append(menu_export)
+    def menu_import(self, context):
+        self.layout.operator(BH_OT_NupImport.bl_idname, text="Bionicle Model (.nup/.hgp)")
+        self.layout.operator(BH_OT_PakImport.bl_idname, text="Bionicle Pak file (.pak)")
 
+    def register():
+        register_()
+        bpy.types.TOPBAR_MT_file_import.append(menu_import)
+        # bpy.types.TOPBAR_MT_file_export.append(menu_export)
 
-def unregister():
-    bpy.types.TOPBAR_MT_file_import.remove(menu_import)
-    # bpy.types.TOPBAR_MT_file_export.remove(menu_export)
-    unregister_()
+    def unregister():
+        bpy.types.TOPBAR_MT_file_import.remove(menu_import)
+        # bpy.types.TOPBAR_MT_file_export.remove(menu_export)
+        unregister_()
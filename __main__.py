@@ -0,0 +1,66 @@
+import argparse
+from pathlib import Path
+
+from .batch import find_models, parse_files, ParseError
+from .pak import Pak, extract_pak
+
+
+def extract(args):
+    for pak_path in args.paks:
+        with Pak(pak_path) as pak:
+            entries = pak.entries(args.patterns)
+            if args.list:
+                for entry in entries:
+                    print(f"{entry.offset:#010x} {entry.size:>10} {entry.name}")
+                continue
+            written, skipped = extract_pak(pak, args.output / pak_path.stem, entries, args.jobs, not args.force)
+            print(f"{pak_path.name}: {written} extracted, {skipped} up to date")
+
+
+def scan(args):
+    total_vertices = total_triangles = total_texture_size = errors = 0
+    for model in parse_files(find_models(args.paths), args.jobs):
+        if isinstance(model, ParseError):
+            print(f"{model.path}: failed, {model.error}")
+            errors += 1
+            continue
+        meshes = [arrays for arrays in model.meshes if arrays is not None]
+        vertices = sum(len(arrays.positions) for arrays in meshes)
+        triangles = sum(len(arrays.triangles) for arrays in meshes)
+        texture_size = sum(len(texture.data) for texture in model.textures)
+        print(f"{model.path}: {len(meshes)} meshes, {vertices} vertices, {triangles} triangles, "
+              f"{len(model.textures)} textures ({texture_size} bytes)")
+        total_vertices += vertices
+        total_triangles += triangles
+        total_texture_size += texture_size
+    print(f"Total: {total_vertices} vertices, {total_triangles} triangles, {total_texture_size} texture bytes, "
+          f"{errors} failed files")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m BionicleHeroesTools", description="Bionicle:Heroes asset tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extract_parser = subparsers.add_parser("extract", help="List and extract .pak entries")
+    extract_parser.add_argument("paks", nargs="+", type=Path, help="Pak files")
+    extract_parser.add_argument("-o", "--output", type=Path, default=Path("."),
+                                help="Output folder, every pak is extracted into subfolder named after it")
+    extract_parser.add_argument("-p", "--pattern", dest="patterns", action="append",
+                                help="Glob pattern of entries to process, can be repeated")
+    extract_parser.add_argument("-l", "--list", action="store_true", help="Only list matching entries")
+    extract_parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker threads")
+    extract_parser.add_argument("-f", "--force", action="store_true",
+                                help="Rewrite files that already have same size and hash")
+    extract_parser.set_defaults(func=extract)
+
+    scan_parser = subparsers.add_parser("scan", help="Parse .nup/.hgp files in parallel and print statistics")
+    scan_parser.add_argument("paths", nargs="+", type=Path, help="Model files or folders searched recursively")
+    scan_parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes")
+    scan_parser.set_defaults(func=scan)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
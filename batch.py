@@ -0,0 +1,291 @@
+import io
+import os
+import pickle
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from multiprocessing import Manager, resource_tracker, shared_memory
+from pathlib import Path
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .file_utils import MMapBuffer
+from .hgp import HGPModel, Bone
+from .mesh_utils import MeshArrays, extract_container_arrays
+from .nup import NupModel, Material, Texture
+
+SHARED_MIN_SIZE = 64 * 1024
+SHARED_ALIGNMENT = 64
+
+# On Windows shared memory is destroyed together with its last handle. Workers keep handles of created segments
+# until parent reports them attached through shared dict, they are closed at the start of the next task
+_KEEP_SEGMENTS = sys.platform == "win32"
+_WORKER_SEGMENTS: List[shared_memory.SharedMemory] = []
+_ATTACHED_SEGMENTS: Optional[Dict[str, bool]] = None
+
+
+@dataclass
+class ParsedModel:
+    """Geometry, materials and textures of single .nup or .hgp file.
+
+    meshes hold arrays of every OBJ0 container (.nup) or layer model (.hgp), None for ones without visible meshes.
+    """
+    path: Path
+    materials: List[Material]
+    textures: List[Texture]
+    meshes: List[Optional[MeshArrays]]
+    instances: Optional[np.ndarray] = field(default=None, repr=False)
+    bones: List[Bone] = field(default_factory=list, repr=False)
+
+
+@dataclass
+class ParseError:
+    """Stands in for result of file that failed to parse, batch goes on with the remaining files."""
+    path: Path
+    error: str
+
+
+def parse_model(path: Path) -> ParsedModel:
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix not in (".nup", ".hgp"):
+        raise ValueError(f"Unsupported file type {path.name!r}")
+    with MMapBuffer(path) as buffer:
+        if suffix == ".hgp":
+            hgp = HGPModel.from_buffer(buffer)
+            meshes = [extract_container_arrays(model, hgp.materials, hgp.vertex_buffers, hgp.index_buffers)
+                      for models, _ in hgp.layers for model in models]
+            return ParsedModel(path, hgp.materials, list(hgp.textures), meshes, bones=hgp.bones)
+        nup = NupModel.from_buffer(buffer)
+        materials = list(nup.ms00 or [])
+        meshes = []
+        if nup.obj0 and nup.vbib:
+            meshes = [extract_container_arrays(container, materials, nup.vbib.vertex_buffers, nup.vbib.index_buffers)
+                      for container in nup.obj0]
+        instances = nup.inst.records if nup.inst else None
+        return ParsedModel(path, materials, list(nup.tst0 or []), meshes, instances)
+
+
+class _SharedPickler(pickle.Pickler):
+    """Keeps large arrays and byte strings out of pickle stream, they are laid out for single shared memory block."""
+
+    def __init__(self, file, min_size: int):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.min_size = min_size
+        self.blocks = []
+        self.size = 0
+        self._offsets = {}
+
+    def _add(self, obj, size: int) -> int:
+        # persistent_id is consulted before pickle memo, same object has to be stored once
+        if id(obj) not in self._offsets:
+            offset = (self.size + SHARED_ALIGNMENT - 1) // SHARED_ALIGNMENT * SHARED_ALIGNMENT
+            self.blocks.append((offset, obj))
+            self.size = offset + size
+            self._offsets[id(obj)] = offset
+        return self._offsets[id(obj)]
+
+    def persistent_id(self, obj):
+        if isinstance(obj, np.ndarray):
+            if obj.nbytes >= self.min_size and not obj.dtype.hasobject:
+                return "array", self._add(obj, obj.nbytes), obj.dtype, obj.shape
+        elif isinstance(obj, (bytes, bytearray, memoryview)):
+            size = memoryview(obj).nbytes
+            if size >= self.min_size:
+                return "bytes", self._add(obj, size), size
+        return None
+
+    def write_blocks(self, buffer: memoryview):
+        for offset, obj in self.blocks:
+            if isinstance(obj, np.ndarray):
+                np.ndarray(obj.shape, obj.dtype, buffer, offset)[...] = obj
+            else:
+                data = memoryview(obj).cast("B")
+                buffer[offset:offset + len(data)] = data
+
+
+class _SharedUnpickler(pickle.Unpickler):
+    def __init__(self, file, buffer: memoryview):
+        super().__init__(file)
+        self.buffer = buffer
+
+    def persistent_load(self, pid):
+        kind, offset, *info = pid
+        if kind == "array":
+            dtype, shape = info
+            return np.ndarray(shape, dtype, self.buffer, offset)
+        size, = info
+        return self.buffer[offset:offset + size].toreadonly()
+
+
+class _SharedBlock(shared_memory.SharedMemory):
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            # Arrays are still alive, mapping will be released together with the last of them
+            pass
+
+
+def _init_worker(attached_segments: Optional[Dict[str, bool]]):
+    global _ATTACHED_SEGMENTS
+    _ATTACHED_SEGMENTS = attached_segments
+
+
+def _release_segments():
+    for segment in list(_WORKER_SEGMENTS):
+        if _ATTACHED_SEGMENTS.pop(segment.name, False):
+            segment.close()
+            _WORKER_SEGMENTS.remove(segment)
+
+
+def _parse_shared(path: Path, min_size: int) -> Tuple[bytes, Optional[str]]:
+    """Worker side: returns pickled metadata and name of shared memory block with large data (None if unused)."""
+    if _ATTACHED_SEGMENTS is not None:
+        _release_segments()
+    try:
+        model = parse_model(path)
+    except Exception as ex:
+        return pickle.dumps(ParseError(Path(path), f"{type(ex).__name__}: {ex}")), None
+    stream = io.BytesIO()
+    pickler = _SharedPickler(stream, min_size)
+    pickler.dump(model)
+    if not pickler.blocks:
+        return stream.getvalue(), None
+    segment = shared_memory.SharedMemory(create=True, size=pickler.size)
+    try:
+        pickler.write_blocks(segment.buf)
+    except BaseException:
+        segment.close()
+        segment.unlink()
+        raise
+    if _ATTACHED_SEGMENTS is not None:
+        _WORKER_SEGMENTS.append(segment)
+    else:
+        segment.close()
+    return stream.getvalue(), segment.name
+
+
+def _load_shared(path: Path, future: Future,
+                 attached_segments: Optional[Dict[str, bool]] = None) -> Union[ParsedModel, ParseError]:
+    try:
+        payload, name = future.result()
+    except Exception as ex:
+        # Worker died or result could not be transferred
+        return ParseError(Path(path), f"{type(ex).__name__}: {ex}")
+    if name is None:
+        return pickle.loads(payload)
+    segment = _SharedBlock(name)
+    # Unlinking only removes the name, mapping stays valid for returned arrays
+    segment.unlink()
+    if attached_segments is not None:
+        attached_segments[name] = True
+    return _SharedUnpickler(io.BytesIO(payload), segment.buf).load()
+
+
+def _discard(future: Future, attached_segments: Optional[Dict[str, bool]] = None):
+    try:
+        _, name = future.result()
+    except Exception:
+        return
+    if name is not None:
+        segment = shared_memory.SharedMemory(name)
+        segment.close()
+        segment.unlink()
+        if attached_segments is not None:
+            attached_segments[name] = True
+
+
+class _ParsePool:
+    """Process pool with results in submission order.
+
+    Crashed worker breaks the whole executor and fails every file in flight, not only the one that crashed it.
+    Executor is replaced and the files are submitted again, file whose result is due is parsed alone first so
+    it is reported as failed only when it breaks the pool by itself.
+    """
+
+    def __init__(self, workers: Optional[int], min_size: int):
+        self.workers = workers
+        self.min_size = min_size
+        self.manager = Manager() if _KEEP_SEGMENTS else None
+        self.attached_segments = self.manager.dict() if self.manager is not None else None
+        self.executor = self._create_executor()
+        self.pending: Deque[Tuple[Path, Future]] = deque()
+
+    def _create_executor(self, workers: Optional[int] = None) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(workers or self.workers, initializer=_init_worker,
+                                   initargs=(self.attached_segments,))
+
+    def _restart(self):
+        self.executor.shutdown(wait=False)
+        self.executor = self._create_executor()
+        for index, (path, future) in enumerate(self.pending):
+            if not future.done() or future.exception() is not None:
+                self.pending[index] = (path, self.executor.submit(_parse_shared, path, self.min_size))
+
+    def submit(self, path: Path):
+        try:
+            future = self.executor.submit(_parse_shared, path, self.min_size)
+        except BrokenProcessPool:
+            self._restart()
+            future = self.executor.submit(_parse_shared, path, self.min_size)
+        self.pending.append((path, future))
+
+    def _parse_alone(self, path: Path) -> Union[ParsedModel, ParseError]:
+        # Result is loaded before the executor shuts down, Windows workers hold their segments until then
+        with self._create_executor(1) as executor:
+            return _load_shared(path, executor.submit(_parse_shared, path, self.min_size), self.attached_segments)
+
+    def result(self) -> Union[ParsedModel, ParseError]:
+        path, future = self.pending.popleft()
+        if isinstance(future.exception(), BrokenProcessPool):
+            self._restart()
+            return self._parse_alone(path)
+        return _load_shared(path, future, self.attached_segments)
+
+    def close(self):
+        for _, future in self.pending:
+            if not future.cancel():
+                _discard(future, self.attached_segments)
+        self.pending.clear()
+        self.executor.shutdown()
+        if self.manager is not None:
+            self.manager.shutdown()
+
+
+def parse_files(paths: Iterable[Path], workers: Optional[int] = None,
+                min_shared_size: int = SHARED_MIN_SIZE) -> Iterator[Union[ParsedModel, ParseError]]:
+    """Parses .nup and .hgp files in process pool, yields results in input order, ParseError for failed files.
+
+    Arrays and byte strings of at least min_shared_size bytes come back through shared memory and are mapped into
+    this process without copying (bytes as read-only memoryviews), only the rest is pickled.
+    """
+    # Segments are created by workers and unlinked here, both have to report to the same tracker process
+    resource_tracker.ensure_running()
+    max_pending = 2 * (workers or os.cpu_count() or 1)
+    pool = _ParsePool(workers, min_shared_size)
+    try:
+        for path in paths:
+            pool.submit(path)
+            if len(pool.pending) >= max_pending:
+                yield pool.result()
+        while pool.pending:
+            yield pool.result()
+    finally:
+        pool.close()
+
+
+def find_models(roots: Iterable[Path]) -> List[Path]:
+    """Expands folders into sorted lists of .nup and .hgp files they contain, files are passed through."""
+    paths = []
+    for root in roots:
+        root = Path(root)
+        if root.is_dir():
+            paths.extend(sorted(path for path in root.rglob("*")
+                                if path.suffix.lower() in (".nup", ".hgp") and path.is_file()))
+        else:
+            paths.append(root)
+    return paths
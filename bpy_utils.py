@@ -1,5 +1,3 @@
-import random
-
 import bpy
 
 
@@ -12,24 +10,6 @@ def get_or_create_collection(name, parent: bpy.types.Collection) -> bpy.types.Co
     return new_collection
 
 
-def add_material(mat_name, model_ob):
-    md = model_ob.data
-    mat = bpy.data.materials.get(mat_name, None)
-    if mat:
-        if md.materials.get(mat.name, None):
-            for i, material in enumerate(md.materials):
-                if material == mat:
-                    return material
-        else:
-            md.materials.append(mat)
-            return mat
-    else:
-        mat = bpy.data.materials.new(mat_name)
-        mat.diffuse_color = [random.uniform(.4, 1) for _ in range(3)] + [1.0]
-        md.materials.append(mat)
-        return mat
-
-
 def append_blend(filepath, type_name, link=False):
     with bpy.data.libraries.load(filepath, link=link) as (data_from, data_to):
         setattr(data_to, type_name, [asset for asset in getattr(data_from, type_name)])
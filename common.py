@@ -1,4 +1,8 @@
-from typing import Tuple
+import struct
+from operator import itemgetter
+from typing import Tuple, Optional
+
+import numpy as np
 
 from .file_utils import Buffer
 
@@ -19,3 +23,86 @@ class Vector4(Tuple[float, float, float, float]):
 
     def __repr__(self):
         return f"Vec3({self[0]:.3f}, {self[1]:.3f}, {self[2]:.3f}, {self[3]:.3f})"
+
+
+_NUMPY_CODES = {"b": "i1", "B": "u1", "h": "i2", "H": "u2", "i": "i4", "I": "u4",
+                "q": "i8", "Q": "u8", "e": "f2", "f": "f4", "d": "f8"}
+
+
+class Schema:
+    """Fixed layout record compiled once into struct.Struct.
+
+    Fields are (name, fmt) or (name, fmt, (rows, columns)) tuples where fmt is a struct format of single
+    field like "I", "17H" or "8x". Padding fields are not returned. Fields with shape are returned as tuple of rows.
+    """
+
+    def __init__(self, *fields: Tuple):
+        self.fields = fields
+        fmt = "".join(field[1] for field in fields)
+        self._structs = {"<": struct.Struct("<" + fmt), ">": struct.Struct(">" + fmt)}
+        self.size = self._structs["<"].size
+        self.names = []
+        self._getters = []
+        index = 0
+        for name, field_fmt, *shape in fields:
+            count = len(struct.unpack("<" + field_fmt, bytes(struct.calcsize("<" + field_fmt))))
+            if count == 0:
+                continue
+            self.names.append(name)
+            if shape:
+                rows, columns = shape[0]
+                assert rows * columns == count, f"Shape {shape[0]} does not match {field_fmt!r}"
+                row_getters = [itemgetter(slice(index + row * columns, index + (row + 1) * columns))
+                               for row in range(rows)]
+                self._getters.append(lambda values, getters=row_getters: tuple(g(values) for g in getters))
+            elif count == 1:
+                self._getters.append(itemgetter(index))
+            else:
+                self._getters.append(itemgetter(slice(index, index + count)))
+            index += count
+        self._flat = index == len(self.names)
+        self._dtype: Optional[np.dtype] = None
+
+    def read(self, buffer: Buffer) -> tuple:
+        values = buffer.read_struct(self._structs[buffer.endian])
+        if self._flat:
+            return values
+        return tuple(getter(values) for getter in self._getters)
+
+    def pack(self, *values, endian: str = "<") -> bytes:
+        """Packs flat record values in field order, fields with shape have to be passed flattened."""
+        return self._structs[endian].pack(*values)
+
+    def unpack_from(self, data, offset: int = 0, endian: str = "<") -> tuple:
+        values = self._structs[endian].unpack_from(data, offset)
+        if self._flat:
+            return values
+        return tuple(getter(values) for getter in self._getters)
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Equivalent little-endian numpy structured dtype, for bulk reads of record arrays."""
+        if self._dtype is None:
+            names, formats, offsets = [], [], []
+            offset = 0
+            for name, field_fmt, *shape in self.fields:
+                size = struct.calcsize("<" + field_fmt)
+                count, code = int(field_fmt[:-1] or 1), field_fmt[-1]
+                if code == "s":
+                    names.append(name)
+                    formats.append(f"S{count}")
+                    offsets.append(offset)
+                elif code != "x":
+                    if code not in _NUMPY_CODES or struct.calcsize("<" + code) * count != size:
+                        raise ValueError(f"Field {name!r} with format {field_fmt!r} has no numpy equivalent")
+                    names.append(name)
+                    if shape:
+                        formats.append(("<" + _NUMPY_CODES[code], shape[0]))
+                    elif count > 1:
+                        formats.append(("<" + _NUMPY_CODES[code], (count,)))
+                    else:
+                        formats.append("<" + _NUMPY_CODES[code])
+                    offsets.append(offset)
+                offset += size
+            self._dtype = np.dtype({"names": names, "formats": formats, "offsets": offsets, "itemsize": offset})
+        return self._dtype
@@ -1,12 +1,25 @@
 import abc
 import binascii
 import contextlib
+import functools
 import io
+import mmap
 import os
 import struct
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from struct import calcsize, pack, unpack
-from typing import Optional, Protocol, Union, TypeVar, Type
+from struct import pack
+from typing import Optional, Protocol, Union, TypeVar, Type, List, Dict
+
+import numpy as np
+
+_HAS_PREAD = hasattr(os, "pread")
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_fmt(fmt: str) -> struct.Struct:
+    return struct.Struct(fmt)
 
 
 class Buffer(abc.ABC, io.RawIOBase):
@@ -55,11 +68,37 @@ class Buffer(abc.ABC, io.RawIOBase):
     def skip(self, size):
         self.seek(size, io.SEEK_CUR)
 
+    @property
+    def endian(self):
+        return self._endian
+
+    def read_struct(self, fmt: struct.Struct):
+        return fmt.unpack(self.read(fmt.size))
+
     def read_fmt(self, fmt):
-        return unpack(self._endian + fmt, self.read(calcsize(self._endian + fmt)))
+        fmt = compile_fmt(self._endian + fmt)
+        return fmt.unpack(self.read(fmt.size))
+
+    def read_array(self, dtype: np.dtype, count: int) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        return np.frombuffer(self.read(dtype.itemsize * count), dtype, count)
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        """Positional read, cursor is left untouched. Thread-safe in MemoryBuffer and FileBuffer."""
+        with self.read_from_offset(offset):
+            return self.read(size)
+
+    def unpack_at(self, fmt: str, offset: int) -> tuple:
+        fmt = compile_fmt(self._endian + fmt)
+        return fmt.unpack(self.read_at(offset, fmt.size))
+
+    def read_array_at(self, dtype: np.dtype, count: int, offset: int) -> np.ndarray:
+        dtype = np.dtype(dtype)
+        return np.frombuffer(self.read_at(offset, dtype.itemsize * count), dtype, count)
 
     def _read(self, fmt):
-        return unpack(self._endian + fmt, self.read(calcsize(self._endian + fmt)))[0]
+        fmt = compile_fmt(self._endian + fmt)
+        return fmt.unpack(self.read(fmt.size))[0]
 
     def read_relative_offset32(self):
         return self.tell() + self.read_uint32()
@@ -180,6 +219,11 @@ class Buffer(abc.ABC, io.RawIOBase):
     def slice(self, offset: Optional[int] = None, size: int = -1) -> 'BufferSlice':
         raise NotImplementedError
 
+    def view(self, offset: int = 0, size: int = -1) -> 'Buffer':
+        """Buffer over part of this one with its own cursor. Unlike slice() it never reads this buffer cursor,
+        so every thread can take its own view of shared buffer."""
+        return self.slice(offset, size)
+
     def read_structure_array(self, offset, count, data_class: Type['Readable']):
         if count == 0:
             return []
@@ -215,15 +259,40 @@ class MemoryBuffer(Buffer):
         return len(self._buffer)
 
     def _read(self, fmt: str):
-        data = struct.unpack_from(self._endian + fmt, self._buffer, self._offset)
-        self._offset += struct.calcsize(self._endian + fmt)
+        fmt = compile_fmt(self._endian + fmt)
+        data = fmt.unpack_from(self._buffer, self._offset)
+        self._offset += fmt.size
         return data[0]
 
     def read_fmt(self, fmt):
-        data = struct.unpack_from(self._endian + fmt, self._buffer, self._offset)
-        self._offset += struct.calcsize(self._endian + fmt)
+        fmt = compile_fmt(self._endian + fmt)
+        data = fmt.unpack_from(self._buffer, self._offset)
+        self._offset += fmt.size
         return data
 
+    def read_struct(self, fmt: struct.Struct):
+        data = fmt.unpack_from(self._buffer, self._offset)
+        self._offset += fmt.size
+        return data
+
+    def read_array(self, dtype: np.dtype, count: int) -> np.ndarray:
+        """Returns read-only array view over the buffer memory, nothing is copied."""
+        dtype = np.dtype(dtype)
+        array = np.frombuffer(self._buffer, dtype, count, self._offset)
+        self._offset += dtype.itemsize * count
+        return array
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        if size == -1:
+            return self._buffer[offset:].tobytes()
+        return self._buffer[offset:offset + size].tobytes()
+
+    def unpack_at(self, fmt: str, offset: int) -> tuple:
+        return compile_fmt(self._endian + fmt).unpack_from(self._buffer, offset)
+
+    def read_array_at(self, dtype: np.dtype, count: int, offset: int) -> np.ndarray:
+        return np.frombuffer(self._buffer, dtype, count, offset)
+
     def write(self, _b: Union[bytes, bytearray]) -> Optional[int]:
         if self._offset + len(_b) > self.size():
             raise BufferError(f"Not enough space left({self.remaining()}) in buffer to write {len(_b)} bytes")
@@ -278,6 +347,13 @@ class MemoryBuffer(Buffer):
             return MemorySliceBuffer(self._buffer[offset:], offset + parent_offset)
         return MemorySliceBuffer(self._buffer[offset:offset + size], offset + parent_offset)
 
+    def view(self, offset: int = 0, size: int = -1) -> 'Buffer':
+        parent_offset = self._parent_offset if isinstance(self, BufferSlice) else 0
+        end = None if size == -1 else offset + size
+        view = MemorySliceBuffer(self._buffer[offset:end], offset + parent_offset)
+        view._endian = self._endian
+        return view
+
 
 class MemorySliceBuffer(BufferSlice, MemoryBuffer):
 
@@ -326,6 +402,9 @@ class FileBuffer(io.FileIO, Buffer):
         Buffer.__init__(self)
         self._cached_size = None
         self._is_read_only = mode == "r" or mode == "rb"
+        # Used for positional reads where os.pread is not available (Windows)
+        self._positional_lock = threading.Lock()
+        self._positional_file: Optional[io.FileIO] = None
 
     def size(self):
         if self._is_read_only:
@@ -351,6 +430,36 @@ class FileBuffer(io.FileIO, Buffer):
     def __str__(self) -> str:
         return f'<FileBuffer: {self.name!r} {self.tell()}/{self.size()}>'
 
+    def read_at(self, offset: int, size: int) -> bytes:
+        if size == -1:
+            size = max(0, self.size() - offset)
+        if _HAS_PREAD:
+            chunks = []
+            while size > 0:
+                chunk = os.pread(self.fileno(), size, offset)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                offset += len(chunk)
+                size -= len(chunk)
+            return b"".join(chunks)
+        with self._positional_lock:
+            if self._positional_file is None:
+                self._positional_file = io.FileIO(self.name, "r")
+            self._positional_file.seek(offset)
+            return self._positional_file.read(size)
+
+    def view(self, offset: int = 0, size: int = -1) -> 'Buffer':
+        if size == -1:
+            size = max(0, self.size() - offset)
+        return FileViewBuffer(self, offset, size)
+
+    def close(self) -> None:
+        super().close()
+        if self._positional_file is not None:
+            self._positional_file.close()
+            self._positional_file = None
+
     def slice(self, offset: Optional[int] = None, size: int = -1) -> 'Buffer':
         with self.save_current_offset():
             tell = self.tell()
@@ -362,6 +471,148 @@ class FileBuffer(io.FileIO, Buffer):
             return MemorySliceBuffer(self.read(size), tell)
 
 
+class FileViewBuffer(BufferSlice):
+    """Read-only window into FileBuffer with its own cursor, all reads are positional reads of the parent file."""
+
+    def __init__(self, file: FileBuffer, offset: int, size: int):
+        BufferSlice.__init__(self, offset)
+        self._file = file
+        self._size = size
+        self._offset = 0
+        self._endian = file.endian
+
+    @property
+    def data(self) -> bytes:
+        return self._file.read_at(self._parent_offset, self._size)
+
+    def size(self):
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, _size: int = -1) -> bytes:
+        if _size == -1 or self._offset + _size > self._size:
+            _size = max(0, self._size - self._offset)
+        data = self._file.read_at(self._parent_offset + self._offset, _size)
+        self._offset += len(data)
+        return data
+
+    def read_at(self, offset: int, size: int) -> bytes:
+        if size == -1 or offset + size > self._size:
+            size = max(0, self._size - offset)
+        return self._file.read_at(self._parent_offset + offset, size)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._offset = offset
+        elif whence == io.SEEK_CUR:
+            self._offset += offset
+        elif whence == io.SEEK_END:
+            self._offset = self._size - offset
+        else:
+            raise ValueError("Invalid whence argument")
+
+        if self._offset > self._size:
+            raise BufferError('Offset is out of bounds')
+
+        return self._offset
+
+    def tell(self) -> int:
+        return self._offset
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def close(self) -> None:
+        pass
+
+    def view(self, offset: int = 0, size: int = -1) -> 'Buffer':
+        if size == -1 or offset + size > self._size:
+            size = max(0, self._size - offset)
+        return FileViewBuffer(self._file, self._parent_offset + offset, size)
+
+    def slice(self, offset: Optional[int] = None, size: int = -1) -> 'Buffer':
+        return self.view(self._offset if offset is None else offset, size)
+
+    def __repr__(self):
+        return f"FileViewBuffer(offset={self._parent_offset}, cursor={self.tell()}, size={self.size()})"
+
+
+class MMapBuffer(MemoryBuffer):
+    """Read-only buffer backed by a memory mapped file. Slices are memoryviews into the mapping and never copy."""
+
+    def __init__(self, file: Union[str, Path]):
+        with open(file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._mmap = None
+        super().__init__(self._mmap if self._mmap is not None else b"")
+        self.name = str(file)
+
+    def close(self) -> None:
+        super().close()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Slices are still alive, mapping will be released together with the last of them
+                pass
+            self._mmap = None
+
+    def __str__(self) -> str:
+        return f'<MMapBuffer: {self.name!r} {self.tell()}/{self.size()}>'
+
+
+class BackgroundWriter:
+    """Writes files from a thread pool so disk I/O overlaps with parsing. wait() re-raises the first write error.
+
+    wait_for() only waits for single queued file, so it can be read while the rest is still being written.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="BH_WRITER")
+        self._futures: Dict[Path, Future] = {}
+
+    @staticmethod
+    def write_file(path: Path, data: bytes):
+        # Readers never see partially written files
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.part")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def write(self, path: Path, data: bytes):
+        self._futures[path] = self._executor.submit(self.write_file, path, data)
+
+    def is_pending(self, path: Path) -> bool:
+        return path in self._futures
+
+    def wait_for(self, path: Path):
+        future = self._futures.pop(path, None)
+        if future is not None:
+            future.result()
+
+    def wait(self):
+        futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 T = TypeVar("T")
 
 
@@ -372,4 +623,4 @@ class Readable(Protocol):
 
 
 __all__ = ['Buffer', 'BufferSlice', 'MemoryBuffer', 'MemorySliceBuffer', 'WritableMemoryBuffer',
-           'WritableMemorySliceBuffer', 'FileBuffer', 'Readable']
+           'WritableMemorySliceBuffer', 'FileBuffer', 'FileViewBuffer', 'MMapBuffer', 'BackgroundWriter', 'Readable']
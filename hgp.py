@@ -1,11 +1,21 @@
 from dataclasses import dataclass, field
 from typing import Optional
 
-from BionicleHeroesTools.common import Vector3
+import numpy as np
+
+from BionicleHeroesTools.common import Vector3, Schema
 from BionicleHeroesTools.file_utils import Buffer
 from BionicleHeroesTools.nup import Material, TST0Chunk, VBIBChunk, Texture, DataBuffer, NupMesh, Container
 
 
+MATRIX_SCHEMA = Schema(("matrix", "16f", (4, 4)))
+BONE_SCHEMA = Schema(
+    ("matrix", "16f", (4, 4)), ("unk_f", "3f"), ("name_offset", "I"), ("parent", "b"), ("flags", "B"),
+    ("unk_h", "H"), ("unk_i", "3I"),
+)
+ATTACHMENT_SCHEMA = Schema(("matrix", "16f", (4, 4)), ("name_offset", "I"), ("unk0", "I"), ("unk1", "I"), ("unk2", "I"))
+
+
 @dataclass
 class Bone:
     matrix: tuple[tuple[float, ...], ...]
@@ -19,12 +29,10 @@ class Bone:
 
     @classmethod
     def from_buffer(cls, buffer: Buffer):
-        matrix = buffer.read_fmt("4f"), buffer.read_fmt("4f"), buffer.read_fmt("4f"), buffer.read_fmt("4f")
-        unk = Vector3.from_buffer(buffer)
-        with buffer.read_from_offset(buffer.read_uint32()):
+        matrix, unk, name_offset, parent, flags, unk_h, unk_i = BONE_SCHEMA.read(buffer)
+        with buffer.read_from_offset(name_offset):
             name = buffer.read_ascii_string()
-        parent, flags, *unk2 = buffer.read_fmt("bBH3I")
-        return cls(matrix, unk, name, parent, flags, unk2)
+        return cls(matrix, Vector3(unk), name, parent, flags, [unk_h, *unk_i])
 
 
 @dataclass
@@ -107,8 +115,7 @@ class Attachment:
 
     @classmethod
     def from_buffer(cls, buffer: Buffer):
-        matrix = buffer.read_fmt("4f"), buffer.read_fmt("4f"), buffer.read_fmt("4f"), buffer.read_fmt("4f")
-        name_offset, unk0, unk1, unk2 = buffer.read_fmt("4I")
+        matrix, name_offset, unk0, unk1, unk2 = ATTACHMENT_SCHEMA.read(buffer)
         with buffer.read_from_offset(name_offset):
             name = buffer.read_ascii_string()
         return cls(name, matrix, unk0, unk1, unk2)
@@ -153,12 +160,10 @@ class HGPModel:
                 bones.append(Bone.from_buffer(buffer))
         with buffer.read_from_offset(matrices_offset):
             for i in range(bone_count):
-                bones[i].matrix1 = buffer.read_fmt("4f"), buffer.read_fmt("4f"), buffer.read_fmt("4f"), buffer.read_fmt(
-                    "4f")
+                bones[i].matrix1, = MATRIX_SCHEMA.read(buffer)
         with buffer.read_from_offset(matrices2_offset):
             for i in range(bone_count):
-                bones[i].matrix2 = buffer.read_fmt("4f"), buffer.read_fmt("4f"), buffer.read_fmt("4f"), buffer.read_fmt(
-                    "4f")
+                bones[i].matrix2, = MATRIX_SCHEMA.read(buffer)
         attachments = []
         with buffer.read_from_offset(attachment_offset):
             for _ in range(attachment_count):
@@ -168,3 +173,24 @@ class HGPModel:
             for _ in range(layer_count):
                 layers.append(Layer.from_buffer(buffer, bone_count))
         return cls(materials, tst, vbib.vertex_buffers, vbib.index_buffers, bones, attachments, layers)
+
+
+def bone_world_matrices(bones: list[Bone]) -> np.ndarray:
+    """Armature space bone matrices (N, 4, 4) in column-vector convention, composed from local matrix1 and parents.
+    Bones of the same hierarchy depth are resolved together."""
+    if not bones:
+        return np.zeros((0, 4, 4), np.float64)
+    local_matrices = np.asarray([bone.matrix1 for bone in bones], np.float64).transpose(0, 2, 1)
+    parents = np.asarray([bone.parent for bone in bones], np.intp)
+    has_parent = parents >= 0
+    depth = np.zeros(len(bones), np.intp)
+    for _ in range(len(bones)):
+        new_depth = np.where(has_parent, depth[parents] + 1, 0)
+        if np.array_equal(new_depth, depth):
+            break
+        depth = new_depth
+    world_matrices = local_matrices.copy()
+    for level in range(1, depth.max() + 1):
+        bone_ids = np.flatnonzero(depth == level)
+        world_matrices[bone_ids] = world_matrices[parents[bone_ids]] @ local_matrices[bone_ids]
+    return world_matrices
@@ -2,10 +2,14 @@ from dataclasses import dataclass, field
 from enum import IntFlag
 from typing import Optional, List, Tuple
 
-from .common import Vector3
+from .common import Vector3, Schema
 from .file_utils import Buffer, BufferSlice
 
 
+SPLINE_POINT_SCHEMA = Schema(("position", "3f"), ("handle_left", "3f"), ("handle_right", "3f"), ("flags", "I"))
+SPLINE_LIST_POINT_SCHEMA = Schema(("position", "3f"), ("unk", "4B"))
+
+
 def read_sstring(buffer: Buffer):
     return buffer.read_ascii_string(buffer.read_uint32())
 
@@ -252,8 +256,8 @@ class Spline:
         point_count, flags, unk1, unk2, unk3, unk4 = record.buffer.read_fmt("5If")
         points = []
         for _ in range(point_count):
-            points.append((Vector3.from_buffer(record.buffer), Vector3.from_buffer(record.buffer),
-                           Vector3.from_buffer(record.buffer), record.buffer.read_uint32()))
+            position, handle_left, handle_right, point_flags = SPLINE_POINT_SCHEMA.read(record.buffer)
+            points.append((Vector3(position), Vector3(handle_left), Vector3(handle_right), point_flags))
         return cls(name, InstFlags(flags), unk1, unk2, unk3, unk4, points)
 
 
@@ -279,7 +283,8 @@ class SplineList:
             splines.append(Spline.from_buffer(record.buffer))
         points_record = Record.from_buffer(record.buffer)
         for _ in range(point_count):
-            points.append((Vector3.from_buffer(points_record.buffer), points_record.buffer.read_fmt("4B")))
+            position, unk = SPLINE_LIST_POINT_SCHEMA.read(points_record.buffer)
+            points.append((Vector3(position), unk))
         assert points_record.buffer.is_empty()
         assert record.buffer.is_empty()
         return cls(record.name, splines, points)
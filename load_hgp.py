@@ -1,37 +1,35 @@
 import math
-import os
 from pathlib import Path
+from typing import Optional
 
 import bpy
-import numpy as np
-from mathutils import Euler, Vector, Matrix
+from mathutils import Euler, Matrix
 
-from BionicleHeroesTools.file_utils import FileBuffer, Buffer
-from BionicleHeroesTools.load_nup import load_textures, create_material
-from BionicleHeroesTools.mesh_utils import unstripify
+from BionicleHeroesTools.file_utils import MMapBuffer, Buffer
+from BionicleHeroesTools.load_nup import create_mesh_data, MaterialRegistry, ImportedTextures
+from BionicleHeroesTools.mesh_utils import extract_container_arrays, group_vertex_weights
 from BionicleHeroesTools.nup import AnimatedTexturesChunk
-from BionicleHeroesTools.hgp import HGPModel
+from BionicleHeroesTools.hgp import HGPModel, bone_world_matrices
+from BionicleHeroesTools.texture_cache import TextureCache
 
 
-def import_hgp_from_buffer(name: str, root_path: Path, hgp_buffer: Buffer):
-    tas_cache = (root_path / "TAS_CACHE")
-    os.makedirs(tas_cache, exist_ok=True)
+def import_hgp_from_buffer(name: str, hgp_buffer: Buffer, texture_mode: str = "PACKED",
+                           texture_cache: Optional[TextureCache] = None):
     hgp = HGPModel.from_buffer(hgp_buffer)
-    import_hgp(hgp, name, tas_cache)
+    import_hgp(hgp, name, texture_cache or TextureCache(), texture_mode)
 
 
-def import_hgp_from_path(hgp_path: Path):
-    with FileBuffer(hgp_path) as buf:
+def import_hgp_from_path(hgp_path: Path, texture_mode: str = "PACKED", texture_cache: Optional[TextureCache] = None):
+    with MMapBuffer(hgp_path) as buf:
         hgp = HGPModel.from_buffer(buf)
 
-    tas_cache = (hgp_path.parent / "TAS_CACHE")
-    os.makedirs(tas_cache, exist_ok=True)
+    import_hgp(hgp, hgp_path.stem, texture_cache or TextureCache(), texture_mode)
 
-    import_hgp(hgp, hgp_path.stem, tas_cache)
 
-
-def import_hgp(hgp, model_name, tas_cache):
-    load_textures(hgp.textures, tas_cache)
+def import_hgp(hgp, model_name, texture_cache: TextureCache, texture_mode: str = "PACKED"):
+    textures = ImportedTextures(hgp.textures, texture_cache, texture_mode)
+    # Texture files are written while the armature is built
+    textures.queue()
     root = bpy.data.objects.new("ROOT", None)
     root.matrix_world = Euler((math.radians(90), 0, 0), "XYZ").to_matrix().to_4x4()
     bpy.context.scene.collection.objects.link(root)
@@ -42,23 +40,18 @@ def import_hgp(hgp, model_name, tas_cache):
     bpy.context.scene.collection.objects.link(armature_obj)
     armature_obj.select_set(True)
     bpy.context.view_layer.objects.active = armature_obj
+    world_matrices = bone_world_matrices(hgp.bones)
+    # Edit bones are only reachable in edit mode, everything else is written directly without pose round trip
     bpy.ops.object.mode_set(mode='EDIT')
     bl_bones = []
     for bone in hgp.bones:
         bl_bone = armature.edit_bones.new(bone.name)
+        bl_bone.tail = (0, 0.3, 0)
         bl_bones.append(bl_bone)
-    for bl_bone, s_bone in zip(bl_bones, hgp.bones):
-        bl_bone.tail = Vector([0, 0, 0.3]) + bl_bone.head
+    for bl_bone, s_bone, world_matrix in zip(bl_bones, hgp.bones, world_matrices):
         if s_bone.parent != -1:
-            bl_parent = bl_bones[s_bone.parent]
-            bl_bone.parent = bl_parent
-    bpy.ops.object.mode_set(mode='POSE')
-    for n, se_bone in enumerate(hgp.bones):
-        bl_bone = armature_obj.pose.bones.get(se_bone.name)
-        mat = Matrix(se_bone.matrix1).transposed()
-        bl_bone.matrix_basis.identity()
-        bl_bone.matrix = bl_bone.parent.matrix @ mat if bl_bone.parent else mat
-    bpy.ops.pose.armature_apply()
+            bl_bone.parent = bl_bones[s_bone.parent]
+        bl_bone.matrix = Matrix(world_matrix.tolist())
     bpy.ops.object.mode_set(mode='OBJECT')
     armature_obj.parent = root
 
@@ -69,159 +62,36 @@ def import_hgp(hgp, model_name, tas_cache):
         attachment_obj.parent_bone = hgp.bones[attachment.unk0].name
         attachment_obj.matrix_local = Matrix(attachment.matrix).transposed()
         bpy.context.scene.collection.objects.link(attachment_obj)
-    for layer in hgp.layers:
-        models, bone_models = layer
-        for model in models:
-            if not model.models:
-                continue
-            vertex_count = 0
-            indices_count = 0
-            indices = []
-            indices_id_offset = 0
-            indices_offset = 0
-            material_indices = []
-            materials_offset = 0
-            for mesh in model.models:
-                if (hgp.materials[mesh.material_id].unk_flags >> 6) & 1:
-                    continue
-
-                strip = mesh.strips[0]
-                index_block = hgp.index_buffers[0]
-                if strip.index_mode == 5:
-                    tri_list = unstripify(index_block.read_indices(strip.indices_offset, strip.indices_count))
-                elif strip.index_mode == 4:
-                    tri_list = index_block.read_indices(strip.indices_offset, strip.indices_count)
-                else:
-                    raise NotImplementedError(f"Unsupported index mode({strip.index_mode})")
-                remapped_indices = np.asarray(tri_list, np.uint32) + indices_id_offset
-                material_indices.extend(np.full(len(tri_list), mesh.material_id))
-                indices.extend(remapped_indices)
-                indices_count += len(tri_list)
-                vertex_count += mesh.vertex_count
-                indices_id_offset += mesh.vertex_count
-                indices_offset += len(tri_list)
-                materials_offset += 1
-
-            vertex_offset = 0
-            global_vertex_data = {}
-
-            mesh_data = bpy.data.meshes.new(model_name + "_DATA")
-            mesh_obj = bpy.data.objects.new(model_name, mesh_data)
-            materials = []
-            for n, material in enumerate(hgp.materials):
-                mat = create_material(AnimatedTexturesChunk(), mesh_obj, material, n, tas_cache)
-                materials.append(mat)
-
-            for entry in model.models:
-                if (hgp.materials[entry.material_id].unk_flags >> 6) & 1:
+    try:
+        material_registry = MaterialRegistry(hgp.materials, AnimatedTexturesChunk(), textures)
+        for layer in hgp.layers:
+            models, bone_models = layer
+            for model in models:
+                arrays = extract_container_arrays(model, hgp.materials, hgp.vertex_buffers, hgp.index_buffers)
+                if arrays is None:
                     continue
 
-                mat = materials[entry.material_id]
-                mat["unk0"] = entry.unk_0
-                mat["unk1"] = entry.unk_1
-
-                material = hgp.materials[entry.material_id]
-                vertex_dtype = material.construct_vertex_dtype()
-                vertex_block = hgp.vertex_buffers[entry.vertex_block_ids[0]]
-                entry_vertex_data = vertex_block.read_vertices(vertex_dtype, entry.vertex_count)
-
-                if "pos" not in global_vertex_data:
-                    global_vertex_data["pos"] = np.zeros((vertex_count, 3), np.float32)
-                vertex_slice = slice(vertex_offset, vertex_offset + entry.vertex_count)
-
-                if material.packed_blend_weight:
-                    blend_weights = entry_vertex_data["weights"].astype(np.float32) / 255
-                    if "weights" not in global_vertex_data:
-                        global_vertex_data["weights"] = np.zeros((vertex_count, 3), np.float32)
-
-                    last_weight = 1 - blend_weights[:, 0] - blend_weights[:, 1]
-                    blend_weights[:, 3] = last_weight
-
-                    global_vertex_data["weights"][vertex_slice] = blend_weights[:, :3]
-
-                if material.blend_weight:
-                    blend_weights = entry_vertex_data["weights"]
-                    if "weights" not in global_vertex_data:
-                        global_vertex_data["weights"] = np.zeros((vertex_count, 2), np.float32)
-                    global_vertex_data["weights"][vertex_slice] = blend_weights
-
-                if material.packed_blend_indices:
-                    blend_indices = entry_vertex_data["indices"].astype(np.uint32)
-                    if "indices" not in global_vertex_data:
-                        global_vertex_data["indices"] = np.zeros((vertex_count, 3), np.uint32)
-                    assert len(entry.strips) == 1
-                    for strip in entry.strips:
-                        remap_table = np.asarray(strip.remap_table, np.uint32)
-                        blend_indices = remap_table[blend_indices[:, :3]]
-                    global_vertex_data["indices"][vertex_slice] = blend_indices
-
-                if material.has_vcolors:
-                    vertex_colors = np.asarray(entry_vertex_data["color"].copy(), np.float32) / 127
-                    tmp = vertex_colors.copy()
-                    vertex_colors[:, 0] = tmp[:, 2]
-                    vertex_colors[:, 1] = tmp[:, 1]
-                    vertex_colors[:, 2] = tmp[:, 0]
-                    vertex_colors[:, 3] = tmp[:, 3]
-                    if "color" not in global_vertex_data:
-                        global_vertex_data["color"] = np.ones((vertex_count, 4), np.float32)
-                    global_vertex_data["color"][vertex_slice] = vertex_colors
-
-                if material.has_vcolors2:
-                    vertex_colors = np.asarray(entry_vertex_data["color1"].copy(), np.float32) / 127
-                    tmp = vertex_colors.copy()
-                    vertex_colors[:, 0] = tmp[:, 2]
-                    vertex_colors[:, 1] = tmp[:, 1]
-                    vertex_colors[:, 2] = tmp[:, 0]
-                    vertex_colors[:, 3] = tmp[:, 3]
-                    if "color1" not in global_vertex_data:
-                        global_vertex_data["color1"] = np.ones((vertex_count, 4), np.float32)
-                    global_vertex_data["color1"][vertex_slice] = vertex_colors
-
-                for uv_layer_id in range(material.uv_layer_count):
-                    uv_name = f"UV{uv_layer_id}"
-                    uv = entry_vertex_data[uv_name].copy()
-                    uv[:, 1] = 1 - uv[:, 1]
-                    if uv_name not in global_vertex_data:
-                        global_vertex_data[uv_name] = np.ones((vertex_count, 2), np.float32)
-                    global_vertex_data[uv_name][vertex_slice] = uv
-
-                global_vertex_data["pos"][vertex_slice] = entry_vertex_data["pos"]
-
-                vertex_offset += entry.vertex_count
-
-            mesh_obj.parent = root
-            mesh_data.from_pydata(global_vertex_data["pos"], [], indices)
-            mesh_data.update()
-            mesh_obj["entity_data"] = {}
-
-            mesh_data.polygons.foreach_set('material_index', material_indices)
-
-            vertex_indices = np.zeros((len(mesh_data.loops, )), dtype=np.uint32)
-            mesh_data.loops.foreach_get('vertex_index', vertex_indices)
-            if "color" in global_vertex_data:
-                vertex_colors = mesh_data.vertex_colors.new(name="col")
-                vertex_colors.data.foreach_set('color', global_vertex_data["color"][vertex_indices].ravel())
-            if "color1" in global_vertex_data:
-                vertex_colors = mesh_data.vertex_colors.new(name="col1")
-                vertex_colors.data.foreach_set('color', global_vertex_data["color1"][vertex_indices].ravel())
-
-            for uv_layer_id in range(8):
-                uv_name = f"UV{uv_layer_id}"
-                if uv_name in global_vertex_data:
-                    uv_layer = mesh_data.uv_layers.new(name=uv_name)
-                    uv_ = global_vertex_data[uv_name].copy()
-                    uv_layer.data.foreach_set('uv', uv_[vertex_indices].flatten())
-
-            if "weights" in global_vertex_data:
-                bone_names = [bone.name for bone in hgp.bones]
-                weight_groups = {bone: mesh_obj.vertex_groups.new(name=bone) for bone in bone_names}
-                for n, (index_group, weight_group), in enumerate(
-                    zip(global_vertex_data["indices"], global_vertex_data["weights"])):
-                    for index, weight in zip(index_group, weight_group):
-                        if weight > 0:
-                            weight_groups[bone_names[index]].add([n], weight, 'REPLACE')
-                modifier = mesh_obj.modifiers.new(type="ARMATURE", name="Armature")
-                modifier.object = armature_obj
-                mesh_obj.parent = armature_obj
-
-            bpy.context.scene.collection.objects.link(mesh_obj)
+                mesh_data = create_mesh_data(model_name + "_DATA", arrays)
+                material_registry.assign(mesh_data, arrays.material_ids)
+                mesh_obj = bpy.data.objects.new(model_name, mesh_data)
+
+                for entry in arrays.meshes:
+                    mat = material_registry.get(entry.material_id)
+                    mat["unk0"] = entry.unk_0
+                    mat["unk1"] = entry.unk_1
+
+                mesh_obj.parent = root
+                mesh_obj["entity_data"] = {}
+
+                if arrays.weights is not None:
+                    bone_names = [bone.name for bone in hgp.bones]
+                    weight_groups = {bone: mesh_obj.vertex_groups.new(name=bone) for bone in bone_names}
+                    for bone_id, weight, vertices in group_vertex_weights(arrays.bone_indices, arrays.weights):
+                        weight_groups[bone_names[bone_id]].add(vertices.tolist(), weight, 'REPLACE')
+                    modifier = mesh_obj.modifiers.new(type="ARMATURE", name="Armature")
+                    modifier.object = armature_obj
+                    mesh_obj.parent = armature_obj
+
+                bpy.context.scene.collection.objects.link(mesh_obj)
+    finally:
+        textures.close()
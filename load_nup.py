@@ -1,24 +1,119 @@
 import math
-import os
+import random
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Dict, List
 
 import numpy as np
 
 import bpy
 from mathutils import Matrix, Vector, Euler
-from .bpy_utils import add_material, get_or_create_collection, append_blend
+from .bpy_utils import get_or_create_collection, append_blend
 from .common import Vector4
-from .file_utils import FileBuffer, Buffer
+from .file_utils import MMapBuffer, Buffer, BackgroundWriter
 from .job import Job, SplineEditor
 from .material_utils import clear_nodes, create_node, Nodes, connect_nodes, create_texture_node, \
-    create_animated_texture_node, create_node_group
-from .mesh_utils import unstripify
+    setup_animated_texture_node, create_node_group
+from .mesh_utils import MeshArrays, extract_container_arrays
 from .nup import NupModel, Container, Texture, Material, AnimatedTexture, Instance, Spec, Spline, TST0Chunk, \
-    AnimatedTexturesChunk
+    AnimatedTexturesChunk, ParticleGroup
+from .spatial import Region, select_instances
+from .texture_cache import TextureCache, texture_digest
+from .texture_utils import decode_texture
+
+
+class ImportedTextures:
+    """Creates Blender images of TST0 textures and TAS0 image sequences the first time they are requested.
+
+    Files loaded from texture cache are written by one background writer for the whole import, queue() starts
+    them ahead of time and every image only waits for its own files before it is loaded.
+    """
+
+    def __init__(self, tst0: TST0Chunk, texture_cache: TextureCache, texture_mode: str = "PACKED"):
+        self.tst0 = tst0
+        self.texture_cache = texture_cache
+        self.texture_mode = texture_mode
+        self.writer = BackgroundWriter()
+        self._images: Dict[int, Optional[bpy.types.Image]] = {}
+        self._keys: Dict[int, str] = {}
+        self._sequences: Dict[Tuple[int, ...], List[Path]] = {}
+        self._cached_images: Optional[Dict[str, bpy.types.Image]] = None
+
+    def queue(self, tas0: Optional[AnimatedTexturesChunk] = None):
+        """Starts cache writes of DISK mode textures and of image sequences tas0 assigns to materials."""
+        if self.texture_mode == "DISK":
+            for index, texture in enumerate(self.tst0):
+                if texture.data:
+                    self._keys[index], _ = self.texture_cache.store(texture.data, self.writer)
+        for _, animated_texture in (tas0.by_material_id.values() if tas0 else ()):
+            self._store_sequence(tuple(animated_texture.frames.tolist()))
+
+    def image(self, texture_id: int) -> Optional[bpy.types.Image]:
+        """Returns image by 1-based texture id used by materials."""
+        if texture_id in self._images:
+            return self._images[texture_id]
+        image = None
+        if 0 < texture_id <= len(self.tst0) and self.tst0[texture_id - 1].data:
+            if self._cached_images is None:
+                self._cached_images = find_cached_images()
+            image = load_texture(self.tst0[texture_id - 1], self.texture_cache, self.texture_mode,
+                                 self._cached_images, self.writer, self._keys.get(texture_id - 1))
+        self._images[texture_id] = image
+        return image
+
+    def _store_sequence(self, frames: Tuple[int, ...]) -> List[Path]:
+        paths = self._sequences.get(frames)
+        if paths is None:
+            key, _ = self.texture_cache.store_sequence([self.tst0[frame].data for frame in frames], self.writer)
+            paths = [self.texture_cache.path(key, n) for n in range(len(frames))]
+            self._sequences[frames] = paths
+        return paths
+
+    def sequence(self, animated_texture: AnimatedTexture) -> Path:
+        """Stores frames of animated texture in texture cache, returns path of the first frame once all are written."""
+        paths = self._store_sequence(tuple(animated_texture.frames.tolist()))
+        # Blender reads the remaining frames of the sequence from disk later on its own
+        for path in paths:
+            self.writer.wait_for(path)
+        return paths[0]
+
+    def close(self):
+        """Waits for the remaining writes, re-raises the first write error."""
+        self.writer.close()
+
+
+MaterialFeatures = Tuple[Optional[str], bool, Optional[str], bool]
+
+
+def get_material_features(tas0: AnimatedTexturesChunk, material_id: int, material: Material,
+                          particle: bool = False) -> Tuple[MaterialFeatures, Optional[AnimatedTexture]]:
+    """Returns (diffuse texture kind, alpha, tint source, specular/normal maps) and animated texture info.
+
+    Tint comes from vertex colors of meshes or from per-particle color of particle billboard instances.
+    """
+    animated_texture_info: Optional[AnimatedTexture] = None
+    if tas0:
+        _, animated_texture_info = tas0.by_material_id.get(material_id, (None, None))
+
+    if animated_texture_info is not None and len(animated_texture_info.frames) > 1 and material.texture_id0:
+        texture_kind = "ANIMATED"
+    elif material.texture_id0:
+        texture_kind = "STATIC"
+    else:
+        texture_kind = None
+    has_texture = texture_kind is not None
+    if particle:
+        tint_source = "INSTANCER"
+    else:
+        tint_source = "VERTEX" if material.has_vcolors and has_texture else None
+    features = (texture_kind,
+                bool(material.transparency2 or material.transparency or material.transparent) and has_texture,
+                tint_source,
+                material.unk_flags == 42)
+    return features, animated_texture_info
 
 
-def build_material(tas0: AnimatedTexturesChunk, material_id: int, mat, material: Material, animated_texture_path: Path):
+def build_material_template(mat, features: MaterialFeatures):
+    texture_kind, has_alpha, tint_source, has_maps = features
     mat.use_nodes = True
     clear_nodes(mat)
 
@@ -34,47 +129,33 @@ def build_material(tas0: AnimatedTexturesChunk, material_id: int, mat, material:
     # if material.texture_id3:
     #     create_texture_node(mat, bpy.data.images[f"tex_{material.texture_id3 - 1:04}.dds"])
 
-    # if material.unk_flags == 42:
-    #     create_texture_node(mat, bpy.data.images[f"tex_{material.texture_ids[0] - 1:04}.dds"])
-    #     create_texture_node(mat, bpy.data.images[f"tex_{material.texture_ids[1] - 1:04}.dds"])
-
-    animated_texture_info: Optional[AnimatedTexture] = None
-    if tas0:
-        animated_texture_info = next(filter(lambda a: a.material_id == material_id, tas0), None)
-
-    if animated_texture_info is not None and len(animated_texture_info.frames) > 1 and material.texture_id0:
-        ati_index = tas0.index(animated_texture_info)
-        tex_node = create_animated_texture_node(mat, animated_texture_path / f"{ati_index}_0000.dds",
-                                                frame_count=animated_texture_info.frame_count - 1)
-    elif material.texture_id0:
-        image = bpy.data.images[f"tex_{material.texture_id0 - 1:04}.dds"]
-        tex_node = create_texture_node(mat, image)
-    else:
-        tex_node = None
+    tex_node = create_texture_node(mat, None, "DIFFUSE") if texture_kind else None
 
     output_node = create_node(mat, Nodes.ShaderNodeOutputMaterial)
-    shader_node = create_node_group(mat, "LB_SPECULAR")
+    shader_node = create_node_group(mat, "LB_SPECULAR", name="SHADER")
     connect_nodes(mat, shader_node.outputs[0], output_node.inputs[0])
     if tex_node:
         connect_nodes(mat, tex_node.outputs[0], shader_node.inputs["Diffuse"])
 
-    if (material.transparency2 or material.transparency or material.transparent) and tex_node:
+    if has_alpha:
         connect_nodes(mat, tex_node.outputs[1], shader_node.inputs["Alpha"])
         mat.blend_method = 'HASHED'
         mat.shadow_method = 'HASHED'
 
-    if material.has_vcolors and tex_node:
+    if tint_source == "VERTEX":
         vertex_color = create_node(mat, Nodes.ShaderNodeVertexColor)
         connect_nodes(mat, vertex_color.outputs[0], shader_node.inputs["Tint"])
-    else:
-        shader_node.inputs["Tint"].default_value = material.color
-
-    if material.unk_flags == 42:
-        t_node = create_texture_node(mat, bpy.data.images[f"tex_{material.texture_ids[0] - 1:04}.dds"])
+    elif tint_source == "INSTANCER":
+        # "color" point attribute of particle group, propagated to billboard instances by BH_PARTICLES
+        particle_color = create_node(mat, Nodes.ShaderNodeAttribute)
+        particle_color.attribute_type = 'INSTANCER'
+        particle_color.attribute_name = "color"
+        connect_nodes(mat, particle_color.outputs["Color"], shader_node.inputs["Tint"])
+
+    if has_maps:
+        t_node = create_texture_node(mat, None, "SPECULAR")
         connect_nodes(mat, t_node.outputs[0], shader_node.inputs["Specular"])
-        t_node = create_texture_node(mat, bpy.data.images[f"tex_{material.texture_ids[1] - 1:04}.dds"])
-        t_node.image.colorspace_settings.name = 'Non-Color'
-
+        t_node = create_texture_node(mat, None, "NORMAL")
         connect_nodes(mat, t_node.outputs[0], shader_node.inputs["Normal"])
         connect_nodes(mat, t_node.outputs[1], shader_node.inputs["AO"])
 
@@ -125,11 +206,51 @@ def build_material(tas0: AnimatedTexturesChunk, material_id: int, mat, material:
     #             connect_nodes(mat, tex_node.outputs[0], bsdf_node.inputs["Alpha"])
 
 
-def create_material(tas0: AnimatedTexturesChunk, obj, material_info: Material, material_id: int,
-                    animated_texture_path: Path):
-    mat = add_material(f"material_{material_id}", obj)
-    if mat.get("loaded", False):
-        return mat
+def get_material_template(features: MaterialFeatures):
+    template_name = ".BH_TEMPLATE_" + "_".join(str(feature) for feature in features)
+    template = bpy.data.materials.get(template_name)
+    if template is None:
+        template = bpy.data.materials.new(template_name)
+        build_material_template(template, features)
+    return template
+
+
+def build_material(tas0: AnimatedTexturesChunk, material_id: int, material: Material, textures: ImportedTextures,
+                   particle: bool = False):
+    features, animated_texture_info = get_material_features(tas0, material_id, material, particle)
+    texture_kind, has_alpha, tint_source, has_maps = features
+    mat = get_material_template(features).copy()
+    nodes = mat.node_tree.nodes
+
+    if texture_kind == "ANIMATED":
+        setup_animated_texture_node(nodes["DIFFUSE"], textures.sequence(animated_texture_info),
+                                    frame_count=animated_texture_info.frame_count - 1)
+    elif texture_kind == "STATIC":
+        nodes["DIFFUSE"].image = textures.image(material.texture_id0)
+
+    if tint_source is None:
+        nodes["SHADER"].inputs["Tint"].default_value = material.color
+
+    if has_maps:
+        nodes["SPECULAR"].image = textures.image(material.texture_ids[0])
+        nodes["NORMAL"].image = textures.image(material.texture_ids[1])
+        if nodes["NORMAL"].image is not None:
+            nodes["NORMAL"].image.colorspace_settings.name = 'Non-Color'
+    return mat
+
+
+def create_material(tas0: AnimatedTexturesChunk, material_info: Material, material_id: int,
+                    textures: ImportedTextures, particle: bool = False):
+    mat_name = f"particle_material_{material_id}" if particle else f"material_{material_id}"
+    old_mat = bpy.data.materials.get(mat_name, None)
+    if old_mat is not None and old_mat.get("loaded", False):
+        return old_mat
+    mat = build_material(tas0, material_id, material_info, textures, particle)
+    if old_mat is not None:
+        old_mat.user_remap(mat)
+        bpy.data.materials.remove(old_mat)
+    mat.name = mat_name
+    mat.diffuse_color = [random.uniform(.4, 1) for _ in range(3)] + [1.0]
     if 1:
         mat["transparency"] = (material_info.flags >> 0) & 1
         mat["b01"] = (material_info.flags >> 1) & 1
@@ -196,142 +317,245 @@ def create_material(tas0: AnimatedTexturesChunk, obj, material_info: Material, m
         mat["unk_b29"] = (material_info.unk_flags >> 29) & 1
         mat["unk_b30"] = (material_info.unk_flags >> 30) & 1
         mat["unk_b31"] = (material_info.unk_flags >> 31) & 1
-    build_material(tas0, material_id, mat, material_info, animated_texture_path)
     mat["loaded"] = True
     return mat
 
 
+class MaterialRegistry:
+    """Builds every MS00 material at most once per import and links only used materials to meshes.
+
+    Particle billboards get their own materials, animated by particle_tas0 and tinted by per-particle color.
+    """
+
+    def __init__(self, materials: List[Material], tas0: AnimatedTexturesChunk, textures: ImportedTextures,
+                 particle_tas0: Optional[AnimatedTexturesChunk] = None):
+        self.materials = materials
+        self.tas0 = tas0
+        self.particle_tas0 = particle_tas0 if particle_tas0 is not None else AnimatedTexturesChunk()
+        self.textures = textures
+        self._cache: Dict[int, bpy.types.Material] = {}
+        self._particle_cache: Dict[int, bpy.types.Material] = {}
+        self._billboards: Dict[int, bpy.types.Object] = {}
+
+    def get(self, material_id: int) -> bpy.types.Material:
+        mat = self._cache.get(material_id)
+        if mat is None:
+            mat = create_material(self.tas0, self.materials[material_id], material_id, self.textures)
+            self._cache[material_id] = mat
+        return mat
+
+    def particle_material(self, material_id: int) -> bpy.types.Material:
+        mat = self._particle_cache.get(material_id)
+        if mat is None:
+            mat = create_material(self.particle_tas0, self.materials[material_id], material_id, self.textures, True)
+            self._particle_cache[material_id] = mat
+        return mat
+
+    def billboard(self, material_id: int) -> bpy.types.Object:
+        """Returns particle billboard object shared by all particle groups using material."""
+        billboard = self._billboards.get(material_id)
+        if billboard is None:
+            billboard = create_billboard(f"BILLBOARD_{material_id}", self.particle_material(material_id))
+            self._billboards[material_id] = billboard
+        return billboard
+
+    def assign(self, mesh_data: bpy.types.Mesh, material_ids: np.ndarray):
+        """Appends material slots used by material_ids to mesh_data and sets polygon material indices."""
+        used_ids, slot_indices = np.unique(material_ids, return_inverse=True)
+        for material_id in used_ids.tolist():
+            mesh_data.materials.append(self.get(material_id))
+        mesh_data.polygons.foreach_set('material_index', slot_indices.astype(np.int32))
+
+
+def create_mesh_data(name: str, arrays: MeshArrays) -> bpy.types.Mesh:
+    vertex_count = len(arrays.positions)
+    triangle_count = len(arrays.triangles)
+    loop_vertex_indices = arrays.triangles.astype(np.int32).ravel()
+
+    mesh_data = bpy.data.meshes.new(name)
+    mesh_data.vertices.add(vertex_count)
+    mesh_data.vertices.foreach_set('co', arrays.positions.astype(np.float32).ravel())
+    mesh_data.loops.add(triangle_count * 3)
+    mesh_data.loops.foreach_set('vertex_index', loop_vertex_indices)
+    mesh_data.polygons.add(triangle_count)
+    mesh_data.polygons.foreach_set('loop_start', np.arange(0, triangle_count * 3, 3, dtype=np.int32))
+    if bpy.app.version < (4, 0, 0):
+        mesh_data.polygons.foreach_set('loop_total', np.full(triangle_count, 3, np.int32))
+    mesh_data.update(calc_edges=True)
+
+    for color_name, layer_name in (("color", "col"), ("color1", "col1")):
+        if color_name in arrays.colors:
+            colors = arrays.colors[color_name]
+            if hasattr(mesh_data, "color_attributes"):
+                color_attribute = mesh_data.color_attributes.new(layer_name, 'FLOAT_COLOR', 'POINT')
+                color_attribute.data.foreach_set('color', colors.ravel())
+                if mesh_data.color_attributes.active_color is None:
+                    # Vertex color shader node without layer name reads active/render color attribute
+                    mesh_data.color_attributes.active_color = color_attribute
+                    if hasattr(mesh_data.color_attributes, "render_color_index"):
+                        mesh_data.color_attributes.render_color_index = mesh_data.color_attributes.active_color_index
+            else:
+                vertex_colors = mesh_data.vertex_colors.new(name=layer_name)
+                vertex_colors.data.foreach_set('color', colors[loop_vertex_indices].ravel())
+
+    for uv_name, uv in arrays.uvs.items():
+        uv_layer = mesh_data.uv_layers.new(name=uv_name)
+        uv_layer.data.foreach_set('uv', uv[loop_vertex_indices].ravel())
+    return mesh_data
+
+
 def load_obj(nup: NupModel, mesh_info: Container, name, matrix: Optional[Matrix],
              parent_object: bpy.types.Object,
              custom_data: dict,
-             animated_texture_path: Path):
-    if mesh_info.models:
-        vertex_count = 0
-        indices_count = 0
-        indices = []
-        indices_id_offset = 0
-        indices_offset = 0
-        material_indices = []
-        materials_offset = 0
-
-        for entry in mesh_info.models:
-            if (nup.ms00[entry.material_id].unk_flags >> 6) & 1:
-                continue
-
-            strip = entry.strips[0]
-            index_block = nup.vbib.index_buffers[0]
-            if strip.index_mode == 5:
-                tri_list = unstripify(index_block.read_indices(strip.indices_offset, strip.indices_count))
-            elif strip.index_mode == 4:
-                tri_list = index_block.read_indices(strip.indices_offset, strip.indices_count)
-            else:
-                raise NotImplementedError(f"Unsupported index mode({strip.index_mode})")
-            remapped_indices = np.asarray(tri_list, np.uint32) + indices_id_offset
-            material_indices.extend(np.full(len(tri_list), entry.material_id))
-            indices.extend(remapped_indices)
-            indices_count += len(tri_list)
-            vertex_count += entry.vertex_count
-            indices_id_offset += entry.vertex_count
-            indices_offset += len(tri_list)
-            materials_offset += 1
-
-        vertex_offset = 0
-        global_vertex_data = {}
-
-        mesh_data = bpy.data.meshes.new(name + "_DATA")
-        mesh_obj = bpy.data.objects.new(name, mesh_data)
-
-        materials = []
-        for n, material in enumerate(nup.ms00):
-            mat = create_material(AnimatedTexturesChunk(), mesh_obj, material, n, animated_texture_path)
-            materials.append(mat)
-
-        for entry in mesh_info.models:
-            if (nup.ms00[entry.material_id].unk_flags >> 6) & 1:
-                continue
-
-            mat = materials[entry.material_id]
-
-            mat["unk0"] = entry.unk_0
-            mat["unk1"] = entry.unk_1
-            mat["vertex_size"] = entry.vertex_size
-
-            material = nup.ms00[entry.material_id]
-            vertex_dtype = material.construct_vertex_dtype()
-            vertex_block = nup.vbib.vertex_buffers[entry.vertex_block_ids[0]]
-            entry_vertex_data = vertex_block.read_vertices(vertex_dtype, entry.vertex_count)
-
-            if "pos" not in global_vertex_data:
-                global_vertex_data["pos"] = np.zeros((vertex_count, 3), np.float32)
-
-            if material.has_vcolors:
-                vertex_colors = np.asarray(entry_vertex_data["color"].copy(), np.float32) / 127
-                tmp = vertex_colors.copy()
-                vertex_colors[:, 0] = tmp[:, 2]
-                vertex_colors[:, 1] = tmp[:, 1]
-                vertex_colors[:, 2] = tmp[:, 0]
-                vertex_colors[:, 3] = tmp[:, 3]
-                if "color" not in global_vertex_data:
-                    global_vertex_data["color"] = np.ones((vertex_count, 4), np.float32)
-                global_vertex_data["color"][vertex_offset:vertex_offset + entry.vertex_count] = vertex_colors
-
-            if material.has_vcolors2:
-                vertex_colors = np.asarray(entry_vertex_data["color1"].copy(), np.float32) / 127
-                tmp = vertex_colors.copy()
-                vertex_colors[:, 0] = tmp[:, 2]
-                vertex_colors[:, 1] = tmp[:, 1]
-                vertex_colors[:, 2] = tmp[:, 0]
-                vertex_colors[:, 3] = tmp[:, 3]
-                if "color1" not in global_vertex_data:
-                    global_vertex_data["color1"] = np.ones((vertex_count, 4), np.float32)
-                global_vertex_data["color1"][vertex_offset:vertex_offset + entry.vertex_count] = vertex_colors
-
-            for uv_layer_id in range(material.uv_layer_count):
-                uv_name = f"UV{uv_layer_id}"
-                uv = entry_vertex_data[uv_name].copy()
-                uv[:, 1] = 1 - uv[:, 1]
-                if uv_name not in global_vertex_data:
-                    global_vertex_data[uv_name] = np.ones((vertex_count, 2), np.float32)
-                global_vertex_data[uv_name][vertex_offset:vertex_offset + entry.vertex_count] = uv
-
-            global_vertex_data["pos"][vertex_offset:vertex_offset + entry.vertex_count] = entry_vertex_data["pos"]
-
-            vertex_offset += entry.vertex_count
-
-        mesh_obj.parent = parent_object
-        mesh_data.from_pydata(global_vertex_data["pos"], [], indices)
-        mesh_data.update()
-        mesh_obj["entity_data"] = {}
-        mesh_obj["entity_data"]["entity"] = custom_data
-
-        mesh_data.polygons.foreach_set('material_index', material_indices)
-
-        vertex_indices = np.zeros((len(mesh_data.loops, )), dtype=np.uint32)
-        mesh_data.loops.foreach_get('vertex_index', vertex_indices)
-        if "color" in global_vertex_data:
-            vertex_colors = mesh_data.vertex_colors.new(name="col")
-            vertex_colors.data.foreach_set('color', global_vertex_data["color"][vertex_indices].ravel())
-        if "color1" in global_vertex_data:
-            vertex_colors = mesh_data.vertex_colors.new(name="col1")
-            vertex_colors.data.foreach_set('color', global_vertex_data["color1"][vertex_indices].ravel())
-
-        for uv_layer_id in range(8):
-            uv_name = f"UV{uv_layer_id}"
-            if uv_name in global_vertex_data:
-                uv_layer = mesh_data.uv_layers.new(name=uv_name)
-                uv_ = global_vertex_data[uv_name].copy()
-                uv_layer.data.foreach_set('uv', uv_[vertex_indices].flatten())
-
-        if matrix is not None:
-            mesh_obj.matrix_local = matrix
-        return mesh_obj
-    return None
+             material_registry: MaterialRegistry):
+    arrays = extract_container_arrays(mesh_info, nup.ms00, nup.vbib.vertex_buffers, nup.vbib.index_buffers)
+    if arrays is None:
+        return None
+
+    mesh_data = create_mesh_data(name + "_DATA", arrays)
+    material_registry.assign(mesh_data, arrays.material_ids)
+    mesh_obj = bpy.data.objects.new(name, mesh_data)
+
+    for entry in arrays.meshes:
+        mat = material_registry.get(entry.material_id)
+        mat["unk0"] = entry.unk_0
+        mat["unk1"] = entry.unk_1
+        mat["vertex_size"] = entry.vertex_size
+
+    setup_instance_obj(mesh_obj, matrix, parent_object, custom_data)
+    return mesh_obj
+
+
+def setup_instance_obj(obj: bpy.types.Object, matrix: Optional[Matrix], parent_object: bpy.types.Object,
+                       custom_data: dict):
+    obj.parent = parent_object
+    obj["entity_data"] = {}
+    obj["entity_data"]["entity"] = custom_data
+    if matrix is not None:
+        obj.matrix_local = matrix
+
+
+def load_linked_obj(mesh_data: bpy.types.Mesh, name, matrix: Optional[Matrix],
+                    parent_object: bpy.types.Object,
+                    custom_data: dict):
+    mesh_obj = bpy.data.objects.new(name, mesh_data)
+    setup_instance_obj(mesh_obj, matrix, parent_object, custom_data)
+    return mesh_obj
+
+
+PARTICLE_MODES = (
+    ("EMPTIES", "Image empties", "One image empty per particle"),
+    ("POINT_CLOUD", "Point clouds", "One point mesh per particle group, instanced with shared billboard"),
+)
+
+
+def get_particle_node_group():
+    group = bpy.data.node_groups.get("BH_PARTICLES")
+    if group is not None:
+        return group
+    group = bpy.data.node_groups.new("BH_PARTICLES", 'GeometryNodeTree')
+    if hasattr(group, "interface"):
+        group.interface.new_socket("Geometry", in_out='INPUT', socket_type='NodeSocketGeometry')
+        group.interface.new_socket("Billboard", in_out='INPUT', socket_type='NodeSocketObject')
+        group.interface.new_socket("Scale", in_out='INPUT', socket_type='NodeSocketVector')
+        group.interface.new_socket("Geometry", in_out='OUTPUT', socket_type='NodeSocketGeometry')
+    else:
+        group.inputs.new('NodeSocketGeometry', "Geometry")
+        group.inputs.new('NodeSocketObject', "Billboard")
+        group.inputs.new('NodeSocketVector', "Scale")
+        group.outputs.new('NodeSocketGeometry', "Geometry")
+    group_input = group.nodes.new('NodeGroupInput')
+    group_output = group.nodes.new('NodeGroupOutput')
+    object_info = group.nodes.new('GeometryNodeObjectInfo')
+    instancer = group.nodes.new('GeometryNodeInstanceOnPoints')
+    group.links.new(group_input.outputs["Billboard"], object_info.inputs["Object"])
+    group.links.new(group_input.outputs["Geometry"], instancer.inputs["Points"])
+    group.links.new(object_info.outputs["Geometry"], instancer.inputs["Instance"])
+    group.links.new(group_input.outputs["Scale"], instancer.inputs["Scale"])
+    group.links.new(instancer.outputs["Instances"], group_output.inputs["Geometry"])
+    return group
+
+
+def get_node_group_input_identifier(group, name: str) -> str:
+    if hasattr(group, "interface"):
+        return group.interface.items_tree[name].identifier
+    return group.inputs[name].identifier
+
+
+def create_billboard(name: str, material: bpy.types.Material) -> bpy.types.Object:
+    # Same extents as image empty with default size and offset, tint comes from particle color of the instance
+    arrays = MeshArrays(np.array([(-.5, -.5, 0), (.5, -.5, 0), (.5, .5, 0), (-.5, .5, 0)], np.float32),
+                        np.array([(0, 1, 2), (0, 2, 3)], np.uint32), np.zeros(2, np.uint32), [],
+                        uvs={"UV0": np.array([(0, 0), (1, 0), (1, 1), (0, 1)], np.float32)})
+    mesh_data = create_mesh_data(f"{name}_DATA", arrays)
+    mesh_data.materials.append(material)
+    billboard = bpy.data.objects.new(name, mesh_data)
+    billboard_collection = get_or_create_collection("PARTICLE_BILLBOARDS", bpy.context.scene.collection)
+    billboard_collection.hide_viewport = True
+    billboard_collection.hide_render = True
+    billboard_collection.objects.link(billboard)
+    return billboard
+
+
+def load_particle_group(name: str, entry: ParticleGroup, billboard: bpy.types.Object) -> bpy.types.Object:
+    count = len(entry.particles)
+    mesh_data = bpy.data.meshes.new(f"{name}_DATA")
+    mesh_data.vertices.add(count)
+    mesh_data.vertices.foreach_set('co', entry.positions.astype(np.float32).ravel())
+    scales = np.ones((count, 3), np.float32)
+    scales[:, :2] = entry.scales
+    mesh_data.attributes.new("scale", 'FLOAT_VECTOR', 'POINT').data.foreach_set('vector', scales.ravel())
+    colors = entry.colors.astype(np.float32) / 127
+    mesh_data.attributes.new("color", 'FLOAT_COLOR', 'POINT').data.foreach_set('color', colors.ravel())
+
+    obj = bpy.data.objects.new(name, mesh_data)
+    node_group = get_particle_node_group()
+    modifier = obj.modifiers.new(type="NODES", name="Particles")
+    modifier.node_group = node_group
+    modifier[get_node_group_input_identifier(node_group, "Billboard")] = billboard
+    scale_identifier = get_node_group_input_identifier(node_group, "Scale")
+    modifier[f"{scale_identifier}_use_attribute"] = True
+    modifier[f"{scale_identifier}_attribute_name"] = "scale"
+    return obj
+
+
+def load_particle_empties(nup: NupModel, name: str, entry: ParticleGroup, textures: ImportedTextures):
+    material = nup.ms00[entry.material_id]
+    animated_texture_info: Optional[AnimatedTexture] = None
+    if nup.tas0:
+        _, animated_texture_info = nup.tas0.by_material_id.get(entry.material_id, (None, None))
+    if animated_texture_info is not None and len(animated_texture_info.frames) >= 1 and material.texture_id0:
+        image = bpy.data.images.load(textures.sequence(animated_texture_info).as_posix(), check_existing=True)
+        image.source = 'SEQUENCE'
+    else:
+        image = textures.image(material.texture_id0)
+
+    objects = []
+    for j, (position, scale, color) in enumerate(zip(entry.positions.tolist(), entry.scales.tolist(),
+                                                     entry.colors.tolist())):
+        obj2 = bpy.data.objects.new(f"{name}_{j}", None)
+        obj2.location = position
+        obj2.empty_display_type = 'IMAGE'
+        obj2.data = image
+        if image is not None and image.source == 'SEQUENCE':
+            obj2.image_user.use_auto_refresh = True
+            obj2.image_user.use_cyclic = True
+            obj2.image_user.frame_duration = animated_texture_info.frame_count - 1
+            obj2.image_user.frame_start = 0
+        obj2.scale[0] = scale[0]
+        obj2.scale[1] = scale[1]
+        obj2.use_empty_image_alpha = True
+        obj2.color = [channel / 127 for channel in color]
+        objects.append(obj2)
+    return objects
 
 
 def load_particle(nup: NupModel, object_info: Container, name: str, matrix: Optional[Matrix],
                   parent_object: bpy.types.Object,
                   custom_data: dict,
-                  animated_texture_path: Path):
+                  textures: ImportedTextures,
+                  material_registry: MaterialRegistry,
+                  particle_mode: str = "EMPTIES"):
     objects = []
     obj = bpy.data.objects.new(name, None)
     obj.matrix_local = matrix
@@ -340,49 +564,30 @@ def load_particle(nup: NupModel, object_info: Container, name: str, matrix: Opti
     obj["entity_data"]["entity"] = custom_data
 
     for n, entry in enumerate(object_info.particle_groups):
-        for j, (unk, unk1) in enumerate(zip(entry.positions, entry.scale_and_color)):
-            obj2 = bpy.data.objects.new(f"{name}_{n}_{j}", None)
-            obj2.location = unk
-            obj2.parent = obj
-            obj2.empty_display_type = 'IMAGE'
-            material = nup.ms00[entry.material_id]
-            animated_texture_info: AnimatedTexture = next(
-                filter(lambda a: a.material_id == entry.material_id, nup.tas0), None)
-
-            if animated_texture_info is not None and len(
-                animated_texture_info.frames) >= 1 and material.texture_id0:
-                ati_index = nup.tas0.index(animated_texture_info)
-                image = (bpy.data.images.get((animated_texture_path / f"{ati_index}_0000.dds").as_posix()) or
-                         bpy.data.images.load((animated_texture_path / f"{ati_index}_0000.dds").as_posix()))
-                obj2.data = image
-                obj2.data.source = 'SEQUENCE'
-                obj2.image_user.use_auto_refresh = True
-                obj2.image_user.use_cyclic = True
-                obj2.image_user.frame_duration = animated_texture_info.frame_count - 1
-                obj2.image_user.frame_start = 0
-            else:
-                obj2.data = bpy.data.images.get(f"tex_{material.texture_id0 - 1}")
-            obj2.scale[0] = unk1[0]
-            obj2.scale[1] = unk1[1]
-            obj2.use_empty_image_alpha = True
-            obj2.color[0] = unk1[2] / 127
-            obj2.color[1] = unk1[3] / 127
-            obj2.color[2] = unk1[4] / 127
-            obj2.color[3] = unk1[5] / 127
-
-            objects.append(obj2)
+        if particle_mode == "EMPTIES":
+            group_objects = load_particle_empties(nup, f"{name}_{n}", entry, textures)
+        else:
+            billboard = material_registry.billboard(entry.material_id)
+            group_objects = [load_particle_group(f"{name}_{n}", entry, billboard)]
+        for group_object in group_objects:
+            group_object.parent = obj
+        objects.extend(group_objects)
     objects.append(obj)
     return objects
 
 
 def load_inst(nup: NupModel, instance: Instance,
               name: str,
-              texture_cache: Path,
+              textures: ImportedTextures,
               override_matrix: Optional[Matrix] = None,
               parent_collection: Optional[bpy.types.Collection] = None,
               parent_object: Optional[bpy.types.Object] = None,
-              bbox_data: Optional[Tuple[Vector4, Tuple[Vector4, Vector4]]] = None):
-    mesh_data = nup.obj0[(instance.mesh_id & 0x000FFFFF)]
+              bbox_data: Optional[Tuple[Vector4, Tuple[Vector4, Vector4]]] = None,
+              mesh_cache: Optional[Dict[int, bpy.types.Mesh]] = None,
+              material_registry: Optional[MaterialRegistry] = None,
+              particle_mode: str = "EMPTIES"):
+    container_id = instance.mesh_id & 0x000FFFFF
+    mesh_data = nup.obj0[container_id]
     if not (mesh_data.models or mesh_data.particle_groups):
         print("Instance without geometry/billboard data")
         return []
@@ -390,13 +595,21 @@ def load_inst(nup: NupModel, instance: Instance,
     custom_data = {"inst_flags": instance.flags,
                    "inst_unk0": instance.unk0,
                    "inst_unk1": instance.unk1, }
+    if material_registry is None:
+        material_registry = MaterialRegistry(nup.ms00, AnimatedTexturesChunk(), textures, nup.tas0)
     if mesh_data.models:
-        object = load_obj(nup, mesh_data, name, override_matrix or matrix, parent_object, custom_data,
-                          texture_cache)
+        if mesh_cache is not None and container_id in mesh_cache:
+            object = load_linked_obj(mesh_cache[container_id], name, override_matrix or matrix, parent_object,
+                                     custom_data)
+        else:
+            object = load_obj(nup, mesh_data, name, override_matrix or matrix, parent_object, custom_data,
+                              material_registry)
+            if mesh_cache is not None and object is not None:
+                mesh_cache[container_id] = object.data
         objects = [object]
     elif mesh_data.particle_groups:
         objects = load_particle(nup, mesh_data, name, override_matrix or matrix, parent_object, custom_data,
-                                texture_cache)
+                                textures, material_registry, particle_mode)
     else:
         print(f"Unsupported type of Instance: {instance}")
         return []
@@ -419,32 +632,80 @@ def load_inst(nup: NupModel, instance: Instance,
     return objects
 
 
-def prepare_animated_textures(nup: NupModel, cache_folder: Path):
-    if nup.tas0:
-        for anim_id, anim_tex in enumerate(nup.tas0):
-            anim_tex: AnimatedTexture
-            anim_name = nup.ntbl[anim_tex.name_offset]
-            anim_other_name = nup.ntbl[anim_tex.other_name_offset]
-            assert anim_name == anim_other_name
-            for n, frame in enumerate(anim_tex.frames):
-                tex = nup.tst0[frame]
-                frame_name = f"{anim_id}_{n:04}.dds"
-                with (cache_folder / frame_name).open("wb") as f:
-                    f.write(tex.data)
-
-
-def load_textures(tst0: TST0Chunk, cache_folder: Path):
-    for i, tex in enumerate(tst0):
-        if not tex.data:
-            continue
-        tex: Texture
-        texture_name = f"tex_{i:04}.dds"
-        with (cache_folder / texture_name).open("wb") as f:
-            f.write(tex.data)
-
-        image = bpy.data.images.load((cache_folder / texture_name).as_posix())
-        image.use_fake_user = True
-        image.alpha_mode = 'STRAIGHT'
+TEXTURE_MODES = (
+    ("PACKED", "Packed DDS", "Pack original DDS data into the .blend file, nothing is written to disk"),
+    ("DECODED", "Decoded pixels", "Decode DDS data and pack decoded pixels into the .blend file"),
+    ("DISK", "Cached files", "Write DDS files into shared texture cache folder and load images from there"),
+)
+
+
+def create_image_from_bytes(name: str, data: bytes) -> bpy.types.Image:
+    image = bpy.data.images.new(name, 1, 1)
+    image.filepath_raw = name
+    image.pack(data=data, data_len=len(data))
+    image.source = 'FILE'
+    return image
+
+
+def create_image_from_pixels(name: str, rgba: np.ndarray) -> bpy.types.Image:
+    height, width, _ = rgba.shape
+    image = bpy.data.images.new(name, width, height, alpha=True)
+    # Blender stores rows bottom to top as floats
+    image.pixels.foreach_set((rgba[::-1].astype(np.float32) / 255).ravel())
+    image.pack()
+    return image
+
+
+def find_cached_images() -> Dict[str, bpy.types.Image]:
+    return {image["bh_texture_hash"]: image for image in bpy.data.images if "bh_texture_hash" in image}
+
+
+def load_texture(tex: Texture, texture_cache: TextureCache, texture_mode: str,
+                 cached_images: Dict[str, bpy.types.Image], writer: Optional[BackgroundWriter] = None,
+                 key: Optional[str] = None) -> bpy.types.Image:
+    """Creates image for texture, image already present in blend file is reused by data hash.
+
+    In DISK mode cache file is written by writer when given, image is loaded once its write finished.
+    """
+    key = key or texture_digest(tex.data)
+    image = cached_images.get(key)
+    if image is not None:
+        return image
+    texture_name = f"tex_{key[:16]}.dds"
+    if texture_mode == "DISK":
+        _, path = texture_cache.store(tex.data, writer, key)
+        if writer is not None:
+            writer.wait_for(path)
+        image = bpy.data.images.load(path.as_posix())
+        image.name = texture_name
+    elif texture_mode == "DECODED":
+        try:
+            image = create_image_from_pixels(texture_name, decode_texture(tex))
+        except (NotImplementedError, ValueError):
+            # Unsupported or broken data is packed as is, like in PACKED mode
+            image = create_image_from_bytes(texture_name, tex.data)
+    else:
+        image = create_image_from_bytes(texture_name, tex.data)
+    cached_images[key] = setup_texture_image(image, key)
+    return image
+
+
+def load_textures(tst0: TST0Chunk, texture_cache: TextureCache,
+                  texture_mode: str = "PACKED") -> List[Optional[bpy.types.Image]]:
+    """Eagerly creates images for all TST0 textures."""
+    textures = ImportedTextures(tst0, texture_cache, texture_mode)
+    try:
+        textures.queue()
+        return [textures.image(texture_id) for texture_id in range(1, len(tst0) + 1)]
+    finally:
+        textures.close()
+
+
+def setup_texture_image(image: bpy.types.Image, key: str):
+    image["bh_texture_hash"] = key
+    image.use_fake_user = True
+    image.alpha_mode = 'STRAIGHT'
+    return image
 
 
 def load_job(job: Job, parent_object: bpy.types.Object, parent_collection: bpy.types.Collection):
@@ -515,67 +776,82 @@ def load_spline(nup: NupModel, spline: Spline,
     curve_object.parent = parent_object
 
 
-def import_nup_from_buffer(root_path: Path, nup_buffer: Buffer):
-    tas_cache = (root_path / "TAS_CACHE")
-    os.makedirs(tas_cache, exist_ok=True)
+def import_nup_from_buffer(nup_buffer: Buffer, texture_mode: str = "PACKED",
+                           texture_cache: Optional[TextureCache] = None, particle_mode: str = "EMPTIES"):
     nup = NupModel.from_buffer(nup_buffer)
-    import_nup(nup, tas_cache)
+    import_nup(nup, texture_cache or TextureCache(), texture_mode, particle_mode)
 
 
-def import_nup_from_path(nup_path: Path):
+def import_nup_from_path(nup_path: Path, texture_mode: str = "PACKED", texture_cache: Optional[TextureCache] = None,
+                         particle_mode: str = "EMPTIES", region: Optional[Region] = None):
     job_path = nup_path.with_suffix(".job")
-    tas_cache = (nup_path.parent / "TAS_CACHE")
-    os.makedirs(tas_cache, exist_ok=True)
     if job_path.exists():
-        job = Job.from_buffer(FileBuffer(job_path))
+        job = Job.from_buffer(MMapBuffer(job_path))
     else:
         job = None
-    nup = NupModel.from_buffer(FileBuffer(nup_path))
+    nup = NupModel.from_buffer(MMapBuffer(nup_path))
 
-    root, spline_collection = import_nup(nup, tas_cache)
+    root, spline_collection = import_nup(nup, texture_cache or TextureCache(), texture_mode, particle_mode, region)
 
     job_spline_collection = get_or_create_collection("JOB_SPLINES", spline_collection)
     load_job(job, root, job_spline_collection)
 
 
-def import_nup(nup, tas_cache):
-    prepare_animated_textures(nup, tas_cache)
-    load_textures(nup.tst0, tas_cache)
-    root = bpy.data.objects.new("ROOT", None)
-    root.matrix_world = Euler((math.radians(90), 0, 0), "XYZ").to_matrix().to_4x4()
-    bpy.context.scene.collection.objects.link(root)
-    spec_collection = get_or_create_collection("SPEC", bpy.context.scene.collection)
-    inst_collection = get_or_create_collection("INST", bpy.context.scene.collection)
-    inst_to_spec_map = {spec.instance_id: spec for spec in nup.spec}
-    for instance_id, instance in enumerate(nup.inst):
-        if nup.bnds:
-            bbox_data = (nup.bnds.centers[instance_id][:3],
-                         (nup.bnds.bboxes[instance_id][0][:3], nup.bnds.bboxes[instance_id][1][:3]))
-        else:
-            bbox_data = None
-
-        spec: Optional[Spec] = inst_to_spec_map.get(instance_id)
-        if spec is None:
-            parent_collection = inst_collection
-            if instance.flags & 1:
-                parent_collection = get_or_create_collection("INST_HIDDEN", inst_collection)
-            elif not instance.flags & 32:
-                parent_collection = get_or_create_collection("INST_STATIC", inst_collection)
-            load_inst(nup, instance, f"INSTANCE_{instance_id}", tas_cache, None, parent_collection, root, bbox_data)
-        else:
-            parent_collection = spec_collection
-            name = nup.ntbl[spec.name_offset]
-            if "faceon" in name.lower():
-                parent_collection = get_or_create_collection("SPEC_FACEON", spec_collection)
+def get_root_matrix() -> Matrix:
+    """Game space to Blender space conversion applied by ROOT object."""
+    return Euler((math.radians(90), 0, 0), "XYZ").to_matrix().to_4x4()
+
+
+def import_nup(nup, texture_cache: TextureCache, texture_mode: str = "PACKED", particle_mode: str = "EMPTIES",
+               region: Optional[Region] = None):
+    textures = ImportedTextures(nup.tst0, texture_cache, texture_mode)
+    textures.queue(nup.tas0)
+    try:
+        root = bpy.data.objects.new("ROOT", None)
+        root.matrix_world = get_root_matrix()
+        bpy.context.scene.collection.objects.link(root)
+        spec_collection = get_or_create_collection("SPEC", bpy.context.scene.collection)
+        inst_collection = get_or_create_collection("INST", bpy.context.scene.collection)
+        inst_to_spec_map = {spec.instance_id: spec for spec in nup.spec}
+        instance_matrices = np.transpose(nup.inst.matrices, (0, 2, 1))
+        mesh_cache: Dict[int, bpy.types.Mesh] = {}
+        material_registry = MaterialRegistry(nup.ms00, AnimatedTexturesChunk(), textures, nup.tas0)
+        selected_instances = select_instances(nup, region)
+        instance_ids = range(len(nup.inst)) if selected_instances is None else selected_instances.tolist()
+        for instance_id in instance_ids:
+            instance = nup.inst[instance_id]
+            if nup.bnds:
+                bbox_data = (nup.bnds.centers[instance_id][:3],
+                             (nup.bnds.bboxes[instance_id][0][:3], nup.bnds.bboxes[instance_id][1][:3]))
             else:
+                bbox_data = None
+
+            spec: Optional[Spec] = inst_to_spec_map.get(instance_id)
+            if spec is None:
+                parent_collection = inst_collection
                 if instance.flags & 1:
-                    parent_collection = get_or_create_collection("SPEC_HIDDEN", spec_collection)
+                    parent_collection = get_or_create_collection("INST_HIDDEN", inst_collection)
                 elif not instance.flags & 32:
-                    parent_collection = get_or_create_collection("SPEC_STATIC", spec_collection)
-            matrix = Matrix(np.transpose(instance.matrix))
-            load_inst(nup, instance, name, tas_cache, matrix, parent_collection, root, bbox_data)
-    spline_collection = get_or_create_collection("SPLINES", bpy.context.scene.collection)
-    sst_spline_collection = get_or_create_collection("SST0_SPLINES", spline_collection)
-    for spline in nup.sst0:
-        load_spline(nup, spline, root, sst_spline_collection)
-    return root, spline_collection
+                    parent_collection = get_or_create_collection("INST_STATIC", inst_collection)
+                load_inst(nup, instance, f"INSTANCE_{instance_id}", textures, None, parent_collection, root,
+                          bbox_data, mesh_cache, material_registry, particle_mode)
+            else:
+                parent_collection = spec_collection
+                name = nup.ntbl[spec.name_offset]
+                if "faceon" in name.lower():
+                    parent_collection = get_or_create_collection("SPEC_FACEON", spec_collection)
+                else:
+                    if instance.flags & 1:
+                        parent_collection = get_or_create_collection("SPEC_HIDDEN", spec_collection)
+                    elif not instance.flags & 32:
+                        parent_collection = get_or_create_collection("SPEC_STATIC", spec_collection)
+                matrix = Matrix(instance_matrices[instance_id])
+                load_inst(nup, instance, name, textures, matrix, parent_collection, root, bbox_data, mesh_cache,
+                          material_registry, particle_mode)
+        spline_collection = get_or_create_collection("SPLINES", bpy.context.scene.collection)
+        sst_spline_collection = get_or_create_collection("SST0_SPLINES", spline_collection)
+        for spline in nup.sst0:
+            load_spline(nup, spline, root, sst_spline_collection)
+        return root, spline_collection
+    finally:
+        textures.close()
@@ -148,17 +148,21 @@ def create_texture_node(material, texture, name=None, location=None):
 
 def create_animated_texture_node(material, path: Path, frame_count: int = 0, name=None, location=None):
     texture_node = create_node(material, Nodes.ShaderNodeTexImage, name)
-    texture_node.image = bpy.data.images.get(path.as_posix()) or bpy.data.images.load(path.as_posix())
+    setup_animated_texture_node(texture_node, path, frame_count)
+
+    if location is not None:
+        texture_node.location = location
+    return texture_node
+
+
+def setup_animated_texture_node(texture_node, path: Path, frame_count: int = 0):
+    texture_node.image = bpy.data.images.load(path.as_posix(), check_existing=True)
     texture_node.image.source = 'SEQUENCE'
     texture_node.image_user.use_auto_refresh = True
     texture_node.image_user.use_cyclic = True
     texture_node.image_user.frame_duration = frame_count
     texture_node.image_user.frame_start = 0
 
-    if location is not None:
-        texture_node.location = location
-    return texture_node
-
 
 def create_node_group(material, group_name, location=None, *, name=None):
     group_node = create_node(material, Nodes.ShaderNodeGroup, name or group_name)
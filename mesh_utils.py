@@ -1,18 +1,180 @@
-from typing import List
-
-
-def unstripify(indices_strip: List[int]):
-    indices = []
-    for i in range(2, len(indices_strip)):
-        if i % 2 == 0:
-            v0 = indices_strip[i - 2]
-            v1 = indices_strip[i - 1]
-            v2 = indices_strip[i]
-        else:
-            v0 = indices_strip[i]
-            v1 = indices_strip[i - 1]
-            v2 = indices_strip[i - 2]
-        if v0 == v1 or v1 == v2:
-            continue
-        indices.append((v0, v1, v2))
-    return indices
+from dataclasses import dataclass, field
+from typing import Optional, Sequence, List, Dict
+
+import numpy as np
+
+from .nup import Container, Material, DataBuffer, NupMesh, Strip
+
+
+def unstripify(indices_strip: Sequence[int], base_vertex: int = 0) -> np.ndarray:
+    """Converts single triangle strip into (M, 3) uint32 triangle list, dropping degenerate triangles."""
+    return unstripify_strips(indices_strip, [len(indices_strip)], [base_vertex])
+
+
+def unstripify_strips(indices: Sequence[int], strip_lengths: Sequence[int],
+                      base_vertices: Optional[Sequence[int]] = None,
+                      return_strip_ids: bool = False):
+    """Converts concatenated triangle strips into one (M, 3) uint32 triangle list.
+
+    strip_lengths holds index count of every strip, base_vertices is added to indices of matching strip.
+    Winding alternates per strip starting with even triangle, degenerate triangles are dropped.
+    With return_strip_ids also returns strip index of every triangle.
+    """
+    indices = np.asarray(indices)
+    strip_lengths = np.asarray(strip_lengths, np.int64)
+    strip_starts = np.cumsum(strip_lengths) - strip_lengths
+    strip_ids = np.repeat(np.arange(len(strip_lengths)), strip_lengths)
+    positions = np.arange(len(indices)) - strip_starts[strip_ids]
+
+    tail = np.flatnonzero(positions >= 2)
+    a = indices[tail - 2]
+    b = indices[tail - 1]
+    c = indices[tail]
+    odd = (positions[tail] & 1).astype(bool)
+    keep = (a != b) & (b != c) & (a != c)
+
+    triangles = np.empty((len(tail), 3), np.uint32)
+    triangles[:, 0] = np.where(odd, c, a)
+    triangles[:, 1] = b
+    triangles[:, 2] = np.where(odd, a, c)
+    triangles = triangles[keep]
+    triangle_strip_ids = strip_ids[tail][keep]
+    if base_vertices is not None:
+        triangles += np.asarray(base_vertices, np.uint32)[triangle_strip_ids][:, None]
+    if return_strip_ids:
+        return triangles, triangle_strip_ids
+    return triangles
+
+
+@dataclass
+class MeshArrays:
+    """Flat geometry of one Container. Vertex attributes are per vertex, material_ids are per triangle."""
+    positions: np.ndarray
+    triangles: np.ndarray
+    material_ids: np.ndarray
+    meshes: List[NupMesh] = field(repr=False)
+    colors: Dict[str, np.ndarray] = field(default_factory=dict, repr=False)
+    uvs: Dict[str, np.ndarray] = field(default_factory=dict, repr=False)
+    weights: Optional[np.ndarray] = field(default=None, repr=False)
+    bone_indices: Optional[np.ndarray] = field(default=None, repr=False)
+
+
+def remap_bone_indices(strips: List[Strip], strip_indices: List[np.ndarray], local_indices: np.ndarray) -> np.ndarray:
+    """Maps per-strip bone palette indices of every vertex into skeleton bone ids.
+
+    Every strip carries its own remap table, vertices use the table of the strip referencing them.
+    """
+    remap_tables = np.zeros((len(strips), max(len(strip.remap_table) for strip in strips) or 1), np.uint32)
+    for strip_id, strip in enumerate(strips):
+        remap_tables[strip_id, :len(strip.remap_table)] = strip.remap_table
+    vertex_strips = np.zeros(len(local_indices), np.intp)
+    if len(strips) > 1:
+        referenced = np.concatenate(strip_indices)
+        vertex_strips[referenced] = np.repeat(np.arange(len(strips)), [len(indices) for indices in strip_indices])
+    return remap_tables[vertex_strips[:, None], local_indices]
+
+
+def group_vertex_weights(bone_indices: np.ndarray, weights: np.ndarray):
+    """Groups non-zero influences by (bone, weight), yielding (bone, weight, vertex indices) per group.
+
+    When vertex references the same bone more than once, the last influence wins, matching per-vertex REPLACE.
+    """
+    influence_count = weights.shape[1]
+    vertices = np.repeat(np.arange(len(weights)), influence_count)
+    bones = bone_indices[:, :influence_count].ravel().astype(np.int64)
+    values = weights.ravel()
+    mask = values > 0
+    vertices, bones, values = vertices[mask], bones[mask], values[mask]
+    if not len(values):
+        return
+
+    keys = vertices * (int(bones.max()) + 1) + bones
+    _, last = np.unique(keys[::-1], return_index=True)
+    last = len(keys) - 1 - last
+    vertices, bones, values = vertices[last], bones[last], values[last]
+
+    order = np.lexsort((vertices, values, bones))
+    vertices, bones, values = vertices[order], bones[order], values[order]
+    group_starts = np.flatnonzero(np.r_[True, (bones[1:] != bones[:-1]) | (values[1:] != values[:-1])])
+    group_ends = np.r_[group_starts[1:], len(values)]
+    for start, end in zip(group_starts, group_ends):
+        yield int(bones[start]), float(values[start]), vertices[start:end]
+
+
+def _convert_color(color: np.ndarray) -> np.ndarray:
+    # Stored as BGRA with 127 being full intensity
+    return color[:, [2, 1, 0, 3]].astype(np.float32) / 127
+
+
+def extract_container_arrays(container: Container, materials: List[Material], vertex_buffers: List[DataBuffer],
+                             index_buffers: List[DataBuffer]) -> Optional[MeshArrays]:
+    meshes = [mesh for mesh in container.models if not (materials[mesh.material_id].unk_flags >> 6) & 1]
+    if not meshes:
+        return None
+    index_block = index_buffers[0]
+    vertex_offsets = np.cumsum([0] + [mesh.vertex_count for mesh in meshes])
+    vertex_count = int(vertex_offsets[-1])
+
+    strips_indices, strip_lengths, strip_offsets, strip_materials = [], [], [], []
+    triangle_lists, triangle_list_materials = [], []
+    mesh_strip_indices = []
+    for mesh, vertex_offset in zip(meshes, vertex_offsets):
+        mesh_strip_indices.append([])
+        for strip in mesh.strips:
+            indices = index_block.read_indices(strip.indices_offset, strip.indices_count)
+            mesh_strip_indices[-1].append(indices)
+            if strip.index_mode == 5:
+                strips_indices.append(indices)
+                strip_lengths.append(len(indices))
+                strip_offsets.append(vertex_offset)
+                strip_materials.append(mesh.material_id)
+            elif strip.index_mode == 4:
+                triangle_list = indices.astype(np.uint32).reshape(-1, 3) + np.uint32(vertex_offset)
+                triangle_lists.append(triangle_list)
+                triangle_list_materials.append(np.full(len(triangle_list), mesh.material_id, np.uint32))
+            else:
+                raise NotImplementedError(f"Unsupported index mode({strip.index_mode})")
+    if strips_indices:
+        triangles, strip_ids = unstripify_strips(np.concatenate(strips_indices), strip_lengths, strip_offsets,
+                                                 return_strip_ids=True)
+        triangle_lists.insert(0, triangles)
+        triangle_list_materials.insert(0, np.asarray(strip_materials, np.uint32)[strip_ids])
+    triangles = np.concatenate(triangle_lists)
+    material_ids = np.concatenate(triangle_list_materials)
+
+    arrays = MeshArrays(np.zeros((vertex_count, 3), np.float32), triangles, material_ids, meshes)
+    for mesh, vertex_offset, strip_indices in zip(meshes, vertex_offsets, mesh_strip_indices):
+        material = materials[mesh.material_id]
+        vertex_data = vertex_buffers[mesh.vertex_block_ids[0]].read_vertices(material.construct_vertex_dtype(),
+                                                                              mesh.vertex_count)
+        vertex_slice = slice(vertex_offset, vertex_offset + mesh.vertex_count)
+        arrays.positions[vertex_slice] = vertex_data["pos"]
+
+        for color_name, has_color in (("color", material.has_vcolors), ("color1", material.has_vcolors2)):
+            if has_color:
+                if color_name not in arrays.colors:
+                    arrays.colors[color_name] = np.ones((vertex_count, 4), np.float32)
+                arrays.colors[color_name][vertex_slice] = _convert_color(vertex_data[color_name])
+
+        for uv_layer_id in range(material.uv_layer_count):
+            uv_name = f"UV{uv_layer_id}"
+            if uv_name not in arrays.uvs:
+                arrays.uvs[uv_name] = np.ones((vertex_count, 2), np.float32)
+            uv = arrays.uvs[uv_name][vertex_slice]
+            uv[:] = vertex_data[uv_name]
+            uv[:, 1] = 1 - uv[:, 1]
+
+        if material.packed_blend_weight or material.blend_weight:
+            if arrays.weights is None:
+                arrays.weights = np.zeros((vertex_count, 3), np.float32)
+            if material.packed_blend_weight:
+                arrays.weights[vertex_slice] = vertex_data["weights"][:, :3].astype(np.float32) / 255
+            else:
+                arrays.weights[vertex_slice, :2] = vertex_data["weights"]
+
+        if material.packed_blend_indices:
+            if arrays.bone_indices is None:
+                arrays.bone_indices = np.zeros((vertex_count, 3), np.uint32)
+            arrays.bone_indices[vertex_slice] = remap_bone_indices(mesh.strips, strip_indices,
+                                                                  vertex_data["indices"][:, :3])
+    return arrays
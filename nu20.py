@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import List, Optional
+from typing import List, Optional, Dict
 
 from .file_utils import Buffer
 
@@ -13,6 +13,12 @@ class Chunk:
 @dataclass
 class NU20:
     chunks: List[Chunk]
+    chunk_index: Dict[str, Chunk] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.chunk_index = {}
+        for chunk in self.chunks:
+            self.chunk_index.setdefault(chunk.name, chunk)
 
     @classmethod
     def from_buffer(cls, buffer: Buffer) -> 'NU20':
@@ -36,7 +42,4 @@ class NU20:
         return cls(chunks)
 
     def find_chunk(self, name: str) -> Optional[Chunk]:
-        for chunk in self.chunks:
-            if chunk.name == name:
-                return chunk
-        return None
+        return self.chunk_index.get(name)
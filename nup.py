@@ -1,13 +1,22 @@
 from dataclasses import dataclass, field
+from functools import cached_property
 from typing import Tuple, List, Optional, Dict
 
 import numpy as np
 
-from .common import Vector3, Vector4
+from .common import Vector3, Vector4, Schema
 from .file_utils import Buffer, BufferSlice
 from .nu20 import NU20
 
 
+STRIP_SCHEMA = Schema(
+    ("unk2", "I"), ("indices_count", "H"), ("indices_count_dup", "H"), ("pad", "8x"),
+    ("remap_size", "H"), ("remap_table", "17H"), ("index_mode", "I"), ("vertex_offset", "I"),
+    ("min_index", "I"), ("vertex_count", "I"), ("indices_offset", "I"),
+    ("indices_count_deg", "I"),  # Polygon count including degenerate polygons
+)
+
+
 @dataclass
 class Strip:
     unk2: int
@@ -22,22 +31,26 @@ class Strip:
 
     @classmethod
     def from_buffer(cls, buffer: Buffer):
-        unk2 = buffer.read_uint32()
-        indices_count = buffer.read_uint16()
-        indices_count_dup = buffer.read_uint16()
+        (unk2, indices_count, indices_count_dup, remap_size, remap_table, index_mode, vertex_offset, min_index,
+         vertex_count, indices_offset, indices_count_deg) = STRIP_SCHEMA.read(buffer)
         assert indices_count == indices_count_dup
-        buffer.skip(8)
-        remap_size = buffer.read_uint16()
-        remap_table = buffer.read_fmt("17H")[:remap_size]
-        # assert sum(read) == 0
-        index_mode = buffer.read_uint32()
-        vertex_offset = buffer.read_uint32()
-        min_index = buffer.read_uint32()
-        vertex_count = buffer.read_uint32()
-        indices_offset = buffer.read_uint32()
-        indices_count_deg = buffer.read_uint32()  # Polygon count including degenerate polygons
         return cls(unk2, indices_count, index_mode, vertex_offset, min_index, vertex_count, indices_offset,
-                   indices_count_deg, remap_table)
+                   indices_count_deg, remap_table[:remap_size])
+
+
+NUP_MESH_SCHEMA = Schema(
+    ("next", "I"), ("material", "I"), ("material_id", "I"), ("field_C", "I"),
+    ("vertex_count", "I"), ("vertex_count_dup", "I"), ("field_18", "I"), ("field_1C", "4I"),
+    ("first_strip_offset", "I"), ("field_30", "I"), ("field_34", "I"), ("field_38", "I"), ("field_3C", "I"),
+    ("field_40", "I"), ("vertex_block_count", "I"), ("vertex_block_ids", "9i"), ("field_6C", "28B"),
+    ("vertex_size", "I"), ("field_8C", "12B"),
+)
+HGP_MESH_SCHEMA = Schema(
+    ("material", "I"), ("material_id", "I"), ("field_C", "I"), ("vertex_count", "I"), ("vertex_count_dup", "I"),
+    ("field_18", "I"), ("field_1C", "4I"), ("first_strip_offset", "I"), ("field_30", "I"), ("field_34", "I"),
+    ("field_38", "I"), ("field_3C", "I"), ("field_40", "I"), ("vertex_block_count", "I"),
+    ("vertex_block_ids", "8i"), ("field_68", "8I"), ("vertex_size", "I"), ("field_8C", "3I"), ("next_strip", "I"),
+)
 
 
 @dataclass
@@ -54,31 +67,23 @@ class NupMesh:
 
     @classmethod
     def from_nup_buffer(cls, buffer: Buffer):
-        assert buffer.read_uint32() == 0  # next
-        assert buffer.read_uint32() == 0  # material
-        material_id = buffer.read_uint32()
-        assert buffer.read_uint32() == 0  # field_C
-        vertex_count = buffer.read_uint32()
-        vertex_count_dup = buffer.read_uint32()
+        entry = buffer.tell()
+        (next_, material, material_id, field_c, vertex_count, vertex_count_dup, unk0, field_1c,
+         first_strip_offset, unk1, field_34, some_offset, field_3c, field_40, field_44, vertex_block_ids,
+         field_6c, vertex_size, field_8c) = NUP_MESH_SCHEMA.read(buffer)
+        assert next_ == 0  # next
+        assert material == 0  # material
+        assert field_c == 0  # field_C
         assert vertex_count_dup == vertex_count
-        unk0 = buffer.read_uint32()  # field_18
-        assert buffer.read_uint32() == 0  # field_1C
-        assert buffer.read_uint32() == 0  # field_20
-        assert buffer.read_uint32() == 0  # field_24
-        assert buffer.read_uint32() == 0  # field_28
-        next_offset = buffer.tell() + buffer.read_uint32()
-        unk1 = buffer.read_uint32()  # field_30
-        assert buffer.read_uint32() == 0  # field_34
-        some_offset = buffer.read_uint32()
+        assert sum(field_1c) == 0  # field_1C..field_28
+        assert field_34 == 0  # field_34
         assert some_offset == 0
-        field_3c = buffer.read_uint32()  # potentially index block id
-        assert field_3c == 0
-        assert buffer.read_uint32() == 0  # field_40
-        field_44 = buffer.read_uint32()
-        vertex_block_ids = [buffer.read_int32() for _ in range(9)][:field_44]
-        assert sum(buffer.read(28)) == 0
-        vertex_size = buffer.read_uint32()
-        assert sum(buffer.read(12)) == 0
+        assert field_3c == 0  # potentially index block id
+        assert field_40 == 0  # field_40
+        assert sum(field_6c) == 0
+        assert sum(field_8c) == 0
+        next_offset = entry + 0x2C + first_strip_offset
+        vertex_block_ids = list(vertex_block_ids[:field_44])
 
         strips: List[Strip] = []
         assert next_offset != 0, "We should have at least one strip"
@@ -93,12 +98,10 @@ class NupMesh:
 
     @classmethod
     def from_hgp_buffer(cls, buffer: Buffer):
-        (material, material_id, field_C, vertex_count, vertex_count_dup, field_18, field_1C, field_20, field_24,
-         field_28, first_strip_p, field_30, field_34, field_38, field_3C, field_40, field_44) = buffer.read_fmt("17I")
-        vertex_block_ids = [buffer.read_int32() for _ in range(8)][:field_44]
-        (field_68, field_6C, field_70, field_74, field_78, field_7C, field_80,
-         field_84, vertex_size, field_8C, field_90, field_94) = buffer.read_fmt("12I")
-        next_offset = buffer.read_uint32()
+        (material, material_id, field_C, vertex_count, vertex_count_dup, field_18, field_1C, first_strip_p, field_30,
+         field_34, field_38, field_3C, field_40, field_44, vertex_block_ids, field_68, vertex_size, field_8C,
+         next_offset) = HGP_MESH_SCHEMA.read(buffer)
+        vertex_block_ids = list(vertex_block_ids[:field_44])
         strips = [Strip.from_buffer(buffer)]
         with buffer.save_current_offset():
             while next_offset != 0:
@@ -107,13 +110,15 @@ class NupMesh:
         return cls(strips, vertex_block_ids, material_id, vertex_count, vertex_size, field_18, field_30)
 
 
+PARTICLE_SCHEMA = Schema(("position", "3f"), ("scale", "2f"), ("color", "4B"))
+
+
 @dataclass
 class ParticleGroup:
     unk_0: int
     unk_1: int
     material_id: int
-    positions: List[Tuple[float, float, float]] = field(repr=False)
-    scale_and_color: List[Tuple[float, float, float]] = field(repr=False)
+    particles: np.ndarray = field(repr=False)
 
     @classmethod
     def from_buffer(cls, buffer: Buffer):
@@ -124,12 +129,19 @@ class ParticleGroup:
         unk1 = buffer.read_uint32()
         count = buffer.read_uint32()
         assert buffer.read_uint32() == 0
-        positions = []
-        scale_and_color = []
-        for _ in range(count):
-            positions.append(buffer.read_fmt("3f"))
-            scale_and_color.append(buffer.read_fmt("2f4B"))
-        return cls(unk0, unk1, material_id, positions, scale_and_color)
+        return cls(unk0, unk1, material_id, buffer.read_array(PARTICLE_SCHEMA.dtype, count))
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self.particles["position"]
+
+    @property
+    def scales(self) -> np.ndarray:
+        return self.particles["scale"]
+
+    @property
+    def colors(self) -> np.ndarray:
+        return self.particles["color"]
 
 
 @dataclass
@@ -210,13 +222,15 @@ class DataBuffer:
         buffer_size, buffer_id, buffer_offset = buffer.read_fmt("3I")
         return cls(buffer.slice(g_buffer_offset + buffer_offset, buffer_size), buffer_id)
 
-    def read_vertices(self, vertex_dtype: np.dtype, count: int):
-        self.buffer.seek(0)
-        return np.frombuffer(self.buffer.read(), vertex_dtype, count)
+    def read_vertices(self, vertex_dtype: np.dtype, count: int, first_vertex: int = 0) -> np.ndarray:
+        """Returns read-only view of count vertices starting at first_vertex, block memory is not copied."""
+        self.buffer.seek(first_vertex * np.dtype(vertex_dtype).itemsize)
+        return self.buffer.read_array(vertex_dtype, count)
 
-    def read_indices(self, offset: int, count: int):
+    def read_indices(self, offset: int, count: int) -> np.ndarray:
+        """Returns read-only uint16 view of count indices starting at offset."""
         self.buffer.seek(offset * 2)
-        return self.buffer.read_fmt(f"{count}H")
+        return self.buffer.read_array(np.uint16, count)
 
 
 @dataclass
@@ -290,6 +304,9 @@ class NTBLChunk(Dict[int, str]):
         return self
 
 
+INSTANCE_SCHEMA = Schema(("matrix", "16f", (4, 4)), ("mesh_id", "I"), ("flags", "I"), ("unk0", "I"), ("unk1", "I"))
+
+
 @dataclass
 class Instance:
     matrix: Tuple[Tuple[float, ...], ...] = field(repr=False)
@@ -300,17 +317,67 @@ class Instance:
 
     @classmethod
     def from_buffer(cls, buffer: Buffer):
-        return cls((buffer.read_fmt("4f"), buffer.read_fmt("4f"),
-                    buffer.read_fmt("4f"), buffer.read_fmt("4f")),
-                   *buffer.read_fmt("4I"))
+        return cls(*INSTANCE_SCHEMA.read(buffer))
+
 
+class RecordTable:
+    """Columnar table of fixed-layout records decoded with single structured read.
+    Indexing and iteration yield row objects of row_class for compatibility with list based chunks."""
+    schema: Schema
+    row_class: type
+
+    def __init__(self, records: np.ndarray):
+        self.records = records
 
-class InstancesChunk(List[Instance]):
     @classmethod
     def from_buffer(cls, buffer: Buffer):
         count = buffer.read_uint32()
         assert buffer.read_uint32() == 0
-        return cls([Instance.from_buffer(buffer) for _ in range(count)])
+        return cls(buffer.read_array(cls.schema.dtype, count))
+
+    @property
+    def matrices(self) -> np.ndarray:
+        """(N, 4, 4) float32 matrices, same row-major layout as stored in file."""
+        return self.records["matrix"]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index: int):
+        matrix, *values = self.records[index].item()
+        return self.row_class(tuple(map(tuple, matrix.tolist())), *values)
+
+    def __iter__(self):
+        for index in range(len(self.records)):
+            yield self[index]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(count={len(self)})"
+
+
+class InstancesChunk(RecordTable):
+    schema = INSTANCE_SCHEMA
+    row_class = Instance
+
+    @property
+    def mesh_id(self) -> np.ndarray:
+        return self.records["mesh_id"]
+
+    @property
+    def flags(self) -> np.ndarray:
+        return self.records["flags"]
+
+    @property
+    def unk0(self) -> np.ndarray:
+        return self.records["unk0"]
+
+    @property
+    def unk1(self) -> np.ndarray:
+        return self.records["unk1"]
+
+
+SPEC_SCHEMA = Schema(("matrix", "16f", (4, 4)), ("instance_id", "I"), ("name_offset", "I"), ("unk0", "i"),
+                     ("unk1", "i"))
 
 
 @dataclass
@@ -323,17 +390,28 @@ class Spec:
 
     @classmethod
     def from_buffer(cls, buffer: Buffer):
-        return cls((buffer.read_fmt("4f"), buffer.read_fmt("4f"),
-                    buffer.read_fmt("4f"), buffer.read_fmt("4f")), *buffer.read_fmt("2I2i"))
+        return cls(*SPEC_SCHEMA.read(buffer))
 
 
-class SpecsChunk(List[Spec]):
+class SpecsChunk(RecordTable):
+    schema = SPEC_SCHEMA
+    row_class = Spec
 
-    @classmethod
-    def from_buffer(cls, buffer: Buffer):
-        count = buffer.read_uint32()
-        assert buffer.read_uint32() == 0
-        return cls([Spec.from_buffer(buffer) for _ in range(count)])
+    @property
+    def instance_id(self) -> np.ndarray:
+        return self.records["instance_id"]
+
+    @property
+    def name_offset(self) -> np.ndarray:
+        return self.records["name_offset"]
+
+    @property
+    def unk0(self) -> np.ndarray:
+        return self.records["unk0"]
+
+    @property
+    def unk1(self) -> np.ndarray:
+        return self.records["unk1"]
 
 
 @dataclass
@@ -348,17 +426,24 @@ class AnimatedTexture:
     name_offset: str
     other_name_offset: str
 
-    frames: List[int]
+    frames: np.ndarray = field(repr=False)
 
     @classmethod
-    def from_buffer(cls, buffer: Buffer, buffer2: Buffer):
+    def from_buffer(cls, buffer: Buffer, frame_table: np.ndarray):
         items = buffer.read_fmt("3IHH4I")
         offset, count = items[2:4]
-        buffer2.seek(offset * 2)
-        return cls(*items, buffer2.read_fmt(f"{count}H"))
+        return cls(*items, frame_table[offset:offset + count])
 
 
 class AnimatedTexturesChunk(List[AnimatedTexture]):
+    """Entries share single uint16 frame table, by_material_id maps material id to (index, entry) of first entry."""
+
+    def __init__(self, items=(), frame_table: Optional[np.ndarray] = None):
+        super().__init__(items)
+        self.frame_table = frame_table if frame_table is not None else np.zeros(0, np.uint16)
+        self.by_material_id: Dict[int, Tuple[int, AnimatedTexture]] = {}
+        for index, animated_texture in enumerate(self):
+            self.by_material_id.setdefault(animated_texture.material_id, (index, animated_texture))
 
     @classmethod
     def from_buffer(cls, buffer: Buffer):
@@ -367,8 +452,8 @@ class AnimatedTexturesChunk(List[AnimatedTexture]):
         entry = buffer.slice(size=count * 32)
         buffer.skip(count * 32)
         count2 = buffer.read_uint32()
-        entry2 = buffer.slice(size=count2 * 2)
-        return cls([AnimatedTexture.from_buffer(entry, entry2) for _ in range(count)])
+        frame_table = buffer.read_array(np.dtype("<u2"), count2)
+        return cls([AnimatedTexture.from_buffer(entry, frame_table) for _ in range(count)], frame_table)
 
 
 @dataclass
@@ -656,71 +741,67 @@ class SST0Chunk(List[Spline]):
 
 @dataclass
 class NupModel:
+    """NU20 chunks are decoded on first attribute access and cached."""
     nu20: NU20 = field(repr=False)
-    ntbl: Optional[NTBLChunk] = field(repr=False)
-    obj0: Optional[Obj0Chunk] = field(repr=False)
-    vbib: Optional[VBIBChunk] = field(repr=False)
-    tst0: Optional[TST0Chunk] = field(repr=False)
-    inst: Optional[InstancesChunk] = field(repr=False)
-    spec: Optional[SpecsChunk] = field(repr=False)
-    tas0: Optional[AnimatedTexturesChunk] = field(repr=False)
-    dno0: Optional[DNO0Chunk] = field(repr=False)
-    nkdt: Optional[NKDTChunk] = field(repr=False)
-    ms00: Optional[MS00Chunk] = field(repr=False)
-    bnds: Optional[BNDSChunk] = field(repr=False)
-    sst0: Optional[SST0Chunk] = field(repr=False)
 
     @classmethod
     def from_buffer(cls, buffer: Buffer):
-        nu20 = NU20.from_buffer(buffer)
-        ntbl: Optional[NTBLChunk] = None
-        obj0: Optional[Obj0Chunk] = None
-        vbib: Optional[VBIBChunk] = None
-        tst0: Optional[TST0Chunk] = None
-        inst: Optional[InstancesChunk] = None
-        spec: Optional[SpecsChunk] = None
-        tas0: Optional[AnimatedTexturesChunk] = None
-        dno0: Optional[DNO0Chunk] = None
-        nkdt: Optional[NKDTChunk] = None
-        ms00: Optional[MS00Chunk] = None
-        bnds: Optional[BNDSChunk] = None
-        sst0: Optional[SST0Chunk] = None
-
-        ntbl_chunk = nu20.find_chunk("NTBL")
-        if ntbl_chunk:
-            ntbl = NTBLChunk.from_buffer(ntbl_chunk.data)
-        obj0_chunk = nu20.find_chunk("OBJ0")
-        if obj0_chunk:
-            obj0 = Obj0Chunk.from_buffer(obj0_chunk.data)
-        vbib_chunk = nu20.find_chunk("VBIB")
-        if vbib_chunk:
-            vbib = VBIBChunk.from_buffer(vbib_chunk.data)
-        tst0_chunk = nu20.find_chunk("TST0") or nu20.find_chunk("TST2")
-        if tst0_chunk:
-            tst0 = TST0Chunk.from_buffer(tst0_chunk.data)
-        inst_chunk = nu20.find_chunk("INST")
-        if inst_chunk:
-            inst = InstancesChunk.from_buffer(inst_chunk.data)
-        spec_chunk = nu20.find_chunk("SPEC")
-        if spec_chunk:
-            spec = SpecsChunk.from_buffer(spec_chunk.data)
-        tas0_chunk = nu20.find_chunk("TAS0")
-        if tas0_chunk:
-            tas0 = AnimatedTexturesChunk.from_buffer(tas0_chunk.data)
-        # dno0_chunk = nu20.find_chunk("DNO2")
-        # if dno0_chunk:
-        #     dno0 = DNO0Chunk.from_buffer(dno0_chunk.data)
-        # nkdt_chunk = nu20.find_chunk("NKDT")
-        # if nkdt_chunk:
-        #     nkdt = NKDTChunk.from_buffer(nkdt_chunk.data)
-        bnds_chunk = nu20.find_chunk("BNDS")
-        if bnds_chunk:
-            bnds = BNDSChunk.from_buffer(bnds_chunk.data)
-        ms00_chunk = nu20.find_chunk("MS00")
-        if ms00_chunk:
-            ms00 = MS00Chunk.from_buffer(ms00_chunk.data)
-        sst0_chunk = nu20.find_chunk("SST0")
-        if sst0_chunk:
-            sst0 = SST0Chunk.from_buffer(sst0_chunk.data)
-
-        return cls(nu20, ntbl, obj0, vbib, tst0, inst, spec, tas0, dno0, nkdt, ms00, bnds, sst0)
+        return cls(NU20.from_buffer(buffer))
+
+    def _decode_chunk(self, chunk_class, *names: str):
+        for name in names:
+            chunk = self.nu20.find_chunk(name)
+            if chunk:
+                chunk.data.seek(0)
+                return chunk_class.from_buffer(chunk.data)
+        return None
+
+    @cached_property
+    def ntbl(self) -> Optional[NTBLChunk]:
+        return self._decode_chunk(NTBLChunk, "NTBL")
+
+    @cached_property
+    def obj0(self) -> Optional[Obj0Chunk]:
+        return self._decode_chunk(Obj0Chunk, "OBJ0")
+
+    @cached_property
+    def vbib(self) -> Optional[VBIBChunk]:
+        return self._decode_chunk(VBIBChunk, "VBIB")
+
+    @cached_property
+    def tst0(self) -> Optional[TST0Chunk]:
+        return self._decode_chunk(TST0Chunk, "TST0", "TST2")
+
+    @cached_property
+    def inst(self) -> Optional[InstancesChunk]:
+        return self._decode_chunk(InstancesChunk, "INST")
+
+    @cached_property
+    def spec(self) -> Optional[SpecsChunk]:
+        return self._decode_chunk(SpecsChunk, "SPEC")
+
+    @cached_property
+    def tas0(self) -> Optional[AnimatedTexturesChunk]:
+        return self._decode_chunk(AnimatedTexturesChunk, "TAS0")
+
+    @cached_property
+    def dno0(self) -> Optional[DNO0Chunk]:
+        # return self._decode_chunk(DNO0Chunk, "DNO2")
+        return None
+
+    @cached_property
+    def nkdt(self) -> Optional[NKDTChunk]:
+        # return self._decode_chunk(NKDTChunk, "NKDT")
+        return None
+
+    @cached_property
+    def ms00(self) -> Optional[MS00Chunk]:
+        return self._decode_chunk(MS00Chunk, "MS00")
+
+    @cached_property
+    def bnds(self) -> Optional[BNDSChunk]:
+        return self._decode_chunk(BNDSChunk, "BNDS")
+
+    @cached_property
+    def sst0(self) -> Optional[SST0Chunk]:
+        return self._decode_chunk(SST0Chunk, "SST0")
@@ -1,11 +1,25 @@
 from pathlib import Path
 
 import bpy
-from bpy.props import StringProperty, BoolProperty, CollectionProperty, FloatProperty
+import numpy as np
+from bpy.props import StringProperty, BoolProperty, CollectionProperty, FloatProperty, EnumProperty, \
+    FloatVectorProperty
+from mathutils import Vector
 
 from .load_hgp import import_hgp_from_path, import_hgp_from_buffer
-from .load_nup import import_nup_from_path, import_nup_from_buffer
+from .load_nup import import_nup_from_path, import_nup_from_buffer, get_root_matrix, TEXTURE_MODES, PARTICLE_MODES
 from .pak import Pak
+from .spatial import BoxRegion, SphereRegion, FrustumRegion, frustum_planes
+from .texture_cache import TextureCache
+
+
+REGION_MODES = (
+    ("ALL", "Everything", "Import all instances"),
+    ("BOX", "Box", "Import instances overlapping box given by region center and size"),
+    ("SPHERE", "Sphere", "Import instances overlapping sphere given by region center and radius"),
+    ("CURSOR", "Around 3D cursor", "Import instances within region radius of the 3D cursor"),
+    ("CAMERA", "Camera view", "Import instances visible from scene camera"),
+)
 
 
 class BH_OT_NupImport(bpy.types.Operator):
@@ -16,6 +30,37 @@ class BH_OT_NupImport(bpy.types.Operator):
     filepath: StringProperty(subtype="FILE_PATH")
     files: CollectionProperty(name='File paths', type=bpy.types.OperatorFileListElement)
     filter_glob: StringProperty(default="*.nup;*.hgp", options={'HIDDEN'})
+    texture_mode: EnumProperty(name="Textures", items=TEXTURE_MODES, default="PACKED")
+    particle_mode: EnumProperty(name="Particles", items=PARTICLE_MODES, default="EMPTIES")
+    region_mode: EnumProperty(name="Region", items=REGION_MODES, default="ALL")
+    region_center: FloatVectorProperty(name="Region center", subtype='XYZ')
+    region_size: FloatVectorProperty(name="Region size", subtype='XYZ', default=(100, 100, 100), min=0)
+    region_radius: FloatProperty(name="Region radius", default=100, min=0)
+
+    def build_region(self, context):
+        """Converts region options from Blender world space into game space used by instance bounds."""
+        to_game = get_root_matrix().inverted()
+        if self.region_mode == "BOX":
+            center = to_game @ Vector(self.region_center)
+            half_size = np.abs(np.asarray(to_game.to_3x3()) @ np.asarray(self.region_size)) / 2
+            return BoxRegion(np.asarray(center) - half_size, np.asarray(center) + half_size)
+        if self.region_mode == "SPHERE":
+            return SphereRegion(np.asarray(to_game @ Vector(self.region_center)), self.region_radius)
+        if self.region_mode == "CURSOR":
+            return SphereRegion(np.asarray(to_game @ context.scene.cursor.location), self.region_radius)
+        if self.region_mode == "CAMERA":
+            camera = context.scene.camera
+            frame = camera.data.view_frame(scene=context.scene)
+            corners = []
+            for depth in (camera.data.clip_start, camera.data.clip_end):
+                for corner in frame:
+                    if camera.data.type == 'ORTHO':
+                        local = Vector((corner.x, corner.y, -depth))
+                    else:
+                        local = corner * (depth / -corner.z)
+                    corners.append(to_game @ camera.matrix_world @ local)
+            return FrustumRegion(frustum_planes(np.asarray(corners)))
+        return None
 
     def execute(self, context):
         if Path(self.filepath).is_file():
@@ -23,10 +68,15 @@ class BH_OT_NupImport(bpy.types.Operator):
         else:
             directory = Path(self.filepath).absolute()
         file = directory / self.filepath
+        if self.region_mode == "CAMERA" and context.scene.camera is None:
+            self.report({'ERROR'}, "Camera region needs active scene camera")
+            return {'CANCELLED'}
+        texture_cache = TextureCache()
         if file.suffix == ".nup":
-            import_nup_from_path(file)
+            import_nup_from_path(file, self.texture_mode, texture_cache, self.particle_mode, self.build_region(context))
         else:
-            import_hgp_from_path(file)
+            import_hgp_from_path(file, self.texture_mode, texture_cache)
+        texture_cache.evict()
         return {'FINISHED'}
 
     def invoke(self, context, event):
@@ -43,6 +93,8 @@ class BH_OT_PakImport(bpy.types.Operator):
     filepath: StringProperty(subtype="FILE_PATH")
     files: CollectionProperty(name='File paths', type=bpy.types.OperatorFileListElement)
     filter_glob: StringProperty(default="*.pak", options={'HIDDEN'})
+    texture_mode: EnumProperty(name="Textures", items=TEXTURE_MODES, default="PACKED")
+    particle_mode: EnumProperty(name="Particles", items=PARTICLE_MODES, default="EMPTIES")
 
     def execute(self, context):
         if Path(self.filepath).is_file():
@@ -51,11 +103,13 @@ class BH_OT_PakImport(bpy.types.Operator):
             directory = Path(self.filepath).absolute()
         file = directory / self.filepath
         pak = Pak(file)
+        texture_cache = TextureCache()
         for name, data in pak.files():
             if name.endswith("nup"):
-                import_nup_from_buffer(file.parent, data)
+                import_nup_from_buffer(data, self.texture_mode, texture_cache, self.particle_mode)
             elif name.endswith("hgp"):
-                import_hgp_from_buffer(Path(name).stem, file.parent, data)
+                import_hgp_from_buffer(Path(name).stem, data, self.texture_mode, texture_cache)
+        texture_cache.evict()
         return {'FINISHED'}
 
     def invoke(self, context, event):
@@ -1,9 +1,25 @@
+import bisect
 import fnmatch
-from dataclasses import dataclass
-from pathlib import Path
-from typing import Optional
+import hashlib
+import json
+import os
+import re
+import shutil
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import Optional, List, Iterable, Tuple, Dict, Iterator, Union, BinaryIO
 
-from BionicleHeroesTools.file_utils import FileBuffer, Buffer
+import numpy as np
+
+from BionicleHeroesTools.common import Schema
+from BionicleHeroesTools.file_utils import MMapBuffer, MemoryBuffer, Buffer, BackgroundWriter
+
+PAK_MAGIC = 305419898
+PAK_HEADER_SIZE = 0x18
+PAK_ENTRY_SCHEMA = Schema(("name_offset", "I"), ("offset", "I"), ("size", "I"), ("extra", "16s"))
+PAK_ALIGNMENT = 16
 
 
 @dataclass
@@ -11,37 +27,490 @@ class Entry:
     name: str
     offset: int
     size: int
+    # Unknown trailing directory fields, kept as is when archive is rewritten
+    extra: bytes = field(default=bytes(16), repr=False)
+
+
+def find_zero(data: np.ndarray, offset: int, window: int = 256) -> int:
+    """Returns position of first zero byte at or after offset (len(data) when there is none), scanning growing
+    windows so only bytes up to the terminator are touched."""
+    while offset < len(data):
+        zeros = np.flatnonzero(data[offset:offset + window] == 0)
+        if len(zeros):
+            return offset + int(zeros[0])
+        offset += window
+        window *= 2
+    return len(data)
+
+
+def split_names(data: memoryview, name_offsets: np.ndarray) -> List[str]:
+    """Decodes zero terminated names of all entries from name blob at once."""
+    if not len(name_offsets):
+        return []
+    raw = np.frombuffer(data, np.uint8)
+    start = int(name_offsets.min())
+    end = find_zero(raw, int(name_offsets.max()))
+    blob = bytes(data[start:end])
+    names = blob.decode("latin", errors="replace").split("\0")
+    name_starts = np.cumsum([0] + [len(name) + 1 for name in names[:-1]]) + start
+    by_offset = dict(zip(name_starts.tolist(), names))
+    result = []
+    for name_offset in name_offsets.tolist():
+        name = by_offset.get(name_offset)
+        if name is None:
+            # Name starts in the middle of another one
+            name = bytes(data[name_offset:find_zero(raw, name_offset)]).decode("latin", errors="replace")
+        result.append(name)
+    return result
+
+
+class NameIndex:
+    """Sorted entry names. Glob patterns with literal prefix only scan names sharing that prefix."""
+
+    def __init__(self, names: Iterable[str]):
+        self.names = sorted(names)
+
+    def glob(self, pattern: str) -> Iterator[str]:
+        prefix = re.split(r"[*?\[]", pattern, 1)[0]
+        if prefix == pattern:
+            index = bisect.bisect_left(self.names, pattern)
+            if index < len(self.names) and self.names[index] == pattern:
+                yield pattern
+            return
+        matcher = re.compile(fnmatch.translate(pattern)).match
+        start = bisect.bisect_left(self.names, prefix)
+        for name in self.names[start:]:
+            if not name.startswith(prefix):
+                break
+            if matcher(name):
+                yield name
 
 
 class Pak:
 
-    def __init__(self, path: Path):
+    def __init__(self, path: Path, entries: Optional[Dict[str, Entry]] = None):
+        """Directory is decoded from archive unless entries from PakIndex are given."""
         self._path = path
-        self._buffer = FileBuffer(path)
+        self._buffer = MMapBuffer(path)
+        self._name_index: Optional[NameIndex] = None
+        self.header_extra = bytes(16)
+        if entries is not None:
+            self._entries = entries
+            return
 
         ident, file_count = self._buffer.read_fmt("2I")
-        if ident != 305419898:
+        if ident != PAK_MAGIC:
             raise ValueError("Not a pak file")
-        self._entries: dict[str, Entry] = {}
-        self._buffer.seek(0x18)
-        for _ in range(file_count):
-            name_offset, file_offset, file_size = self._buffer.read_fmt("3I")
-            self._buffer.skip(0x10)
-            with self._buffer.read_from_offset(name_offset):
-                name = self._buffer.read_ascii_string()
-            self._entries[name] = Entry(name, file_offset, file_size)
+        self.header_extra = self._buffer.read(PAK_HEADER_SIZE - 8)
+        records = self._buffer.read_array(PAK_ENTRY_SCHEMA.dtype, file_count)
+        names = split_names(self._buffer.data, records["name_offset"])
+        self._entries: Dict[str, Entry] = {
+            name: Entry(name, file_offset, file_size, extra.ljust(16, b"\0"))
+            for name, file_offset, file_size, extra in zip(names, records["offset"].tolist(),
+                                                           records["size"].tolist(), records["extra"].tolist())
+        }
 
     def get(self, name: str) -> Optional[Buffer]:
         if name in self._entries:
             entry = self._entries[name]
-            return self._buffer.slice(entry.offset, entry.size)
+            return self._buffer.view(entry.offset, entry.size)
         return None
 
+    @property
+    def name_index(self) -> NameIndex:
+        if self._name_index is None:
+            self._name_index = NameIndex(self._entries)
+        return self._name_index
+
     def glob(self, pattern: str):
-        for name, entry in self._entries.items():
-            if fnmatch.fnmatch(name, pattern):
-                yield name, self.get(name)
+        for name in self.name_index.glob(pattern):
+            yield name, self.get(name)
 
     def files(self):
         for name, entry in self._entries.items():
             yield name, self.get(name)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def entries(self, patterns: Optional[Iterable[str]] = None) -> List[Entry]:
+        """Returns entries matching any of glob patterns (all when None) sorted by offset for sequential reads."""
+        entries = self._entries.values()
+        if patterns:
+            names = {name for pattern in patterns for name in self.name_index.glob(pattern)}
+            entries = [self._entries[name] for name in names]
+        return sorted(entries, key=lambda entry: entry.offset)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    @property
+    def directory(self) -> List[Entry]:
+        """Entries in directory order."""
+        return list(self._entries.values())
+
+    def view(self, entry: Entry) -> memoryview:
+        """Positional read of entry data, does not touch buffer cursor and is safe to use from several threads."""
+        return self._buffer.data[entry.offset:entry.offset + entry.size]
+
+    def close(self):
+        self._buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def entry_output_path(root: Path, name: str) -> Path:
+    """Maps entry name to path inside root, absolute parts and parent references are dropped."""
+    parts = [part for part in PurePosixPath(name.replace("\\", "/")).parts
+             if part not in ("/", "..", ".") and not part.endswith(":")]
+    return root.joinpath(*parts)
+
+
+def _is_up_to_date(path: Path, data: memoryview) -> bool:
+    try:
+        if path.stat().st_size != len(data):
+            return False
+        hasher = hashlib.blake2b()
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hasher.update(chunk)
+        return hasher.digest() == hashlib.blake2b(data).digest()
+    except FileNotFoundError:
+        return False
+
+
+def extract_entry(pak: Pak, entry: Entry, output: Path, incremental: bool = True) -> bool:
+    """Writes entry into output folder, returns False when existing file already has same size and hash."""
+    path = entry_output_path(output, entry.name)
+    data = pak.view(entry)
+    if incremental and _is_up_to_date(path, data):
+        return False
+    os.makedirs(path.parent, exist_ok=True)
+    BackgroundWriter.write_file(path, data)
+    return True
+
+
+def extract_pak(pak: Pak, output: Path, entries: Optional[List[Entry]] = None, workers: Optional[int] = None,
+                incremental: bool = True) -> Tuple[int, int]:
+    """Extracts entries (all by default) in offset order using thread pool. Returns written and skipped counts."""
+    if entries is None:
+        entries = pak.entries()
+    with ThreadPoolExecutor(workers) as executor:
+        results = list(executor.map(lambda entry: extract_entry(pak, entry, output, incremental), entries))
+    written = sum(results)
+    return written, len(results) - written
+
+
+def align(value: int, alignment: int) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+
+EntrySource = Union[bytes, bytearray, memoryview, Buffer, Path]
+
+
+class PakWriter:
+    """Streams entries into pak file, entry data is written to disk as soon as it is added.
+
+    Entry data starts at aligned offsets. Directory and name blob are written on close: names go to the end of file
+    and entries whose data would be overwritten by the grown directory are moved to the end. Use reserve_entries
+    for new archives to avoid such moves.
+
+    New archives are written into .part file next to path and moved over it on close, so path may be the archive
+    entries are read from. Leaving the context with exception discards them.
+    """
+
+    def __init__(self, path: Path, alignment: int = PAK_ALIGNMENT, reserve_entries: int = 0,
+                 header_extra: bytes = bytes(16), _file: Optional[BinaryIO] = None,
+                 _entries: Optional[Dict[str, Entry]] = None):
+        self.path = Path(path)
+        self.alignment = alignment
+        self.header_extra = header_extra
+        self._temp_path: Optional[Path] = None
+        if _file is None:
+            self._temp_path = self.path.with_name(f"{self.path.name}.part")
+            _file = open(self._temp_path, "w+b")
+        self._file = _file
+        self._entries: Dict[str, Entry] = _entries if _entries is not None else {}
+        # Old name blob past the last entry data is overwritten by the new one on close
+        directory_end = PAK_HEADER_SIZE + max(reserve_entries, len(self._entries)) * PAK_ENTRY_SCHEMA.size
+        self._end = max([entry.offset + entry.size for entry in self._entries.values()] +
+                        [align(directory_end, alignment)])
+
+    @classmethod
+    def open(cls, path: Path, alignment: int = PAK_ALIGNMENT):
+        """Opens existing archive for appending and replacing entries in place."""
+        with Pak(path) as pak:
+            entries = {entry.name: entry for entry in pak.directory}
+            header_extra = pak.header_extra
+        return cls(path, alignment, header_extra=header_extra, _file=open(path, "r+b"), _entries=entries)
+
+    def _slot_size(self, entry: Entry) -> int:
+        """Space available for entry data before next entry or end of data, -1 when data is shared with other entry
+        (deduplicated archives) and can't be overwritten."""
+        others = [other for other in self._entries.values() if other is not entry and other.size]
+        if any(other.offset <= entry.offset < other.offset + other.size for other in others):
+            return -1
+        next_offsets = [other.offset for other in others if other.offset > entry.offset]
+        return min(next_offsets, default=self._end) - entry.offset
+
+    def _write_data(self, offset: int, source: EntrySource) -> int:
+        self._file.seek(offset)
+        if isinstance(source, Path):
+            with open(source, "rb") as f:
+                shutil.copyfileobj(f, self._file, 1024 * 1024)
+        elif isinstance(source, MemoryBuffer):
+            self._file.write(source.data)
+        elif isinstance(source, Buffer):
+            source.seek(0)
+            for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                self._file.write(chunk)
+        else:
+            self._file.write(source)
+        return self._file.tell() - offset
+
+    @staticmethod
+    def _source_size(source: EntrySource) -> int:
+        if isinstance(source, Path):
+            return source.stat().st_size
+        if isinstance(source, Buffer):
+            return source.size()
+        return memoryview(source).nbytes
+
+    def add(self, name: str, source: EntrySource, extra: Optional[bytes] = None):
+        """Adds or replaces entry. Replaced data is overwritten in place when it fits into old slot."""
+        size = self._source_size(source)
+        old_entry = self._entries.get(name)
+        if extra is None:
+            extra = old_entry.extra if old_entry is not None else bytes(16)
+        if old_entry is not None and old_entry.offset >= PAK_HEADER_SIZE and size <= self._slot_size(old_entry):
+            offset = old_entry.offset
+        else:
+            offset = align(self._end, self.alignment)
+        written = self._write_data(offset, source)
+        self._end = max(self._end, offset + written)
+        self._entries[name] = Entry(name, offset, written, extra)
+
+    def remove(self, name: str):
+        self._entries.pop(name, None)
+
+    def reorder(self, names: List[str]):
+        """Sets directory order, entries missing from names keep their relative order after listed ones."""
+        order = {name: index for index, name in enumerate(names)}
+        self._entries = dict(sorted(self._entries.items(), key=lambda item: order.get(item[0], len(order))))
+
+    def _relocate(self, entry: Entry) -> Entry:
+        offset = align(self._end, self.alignment)
+        moved = 0
+        while moved < entry.size:
+            self._file.seek(entry.offset + moved)
+            chunk = self._file.read(min(1024 * 1024, entry.size - moved))
+            self._file.seek(offset + moved)
+            self._file.write(chunk)
+            moved += len(chunk)
+        self._end = offset + entry.size
+        return Entry(entry.name, offset, entry.size, entry.extra)
+
+    def close(self):
+        if self._file is None:
+            return
+        directory_end = PAK_HEADER_SIZE + len(self._entries) * PAK_ENTRY_SCHEMA.size
+        for name, entry in sorted(self._entries.items(), key=lambda item: item[1].offset):
+            if entry.size and entry.offset < directory_end:
+                self._entries[name] = self._relocate(entry)
+
+        names_offset = max(self._end, directory_end)
+        name_blob = bytearray()
+        records = bytearray()
+        for name, entry in self._entries.items():
+            records += PAK_ENTRY_SCHEMA.pack(names_offset + len(name_blob), entry.offset, entry.size, entry.extra)
+            name_blob += name.encode("latin", errors="replace") + b"\0"
+        self._file.seek(names_offset)
+        self._file.write(name_blob)
+        self._file.truncate()
+        self._file.seek(0)
+        self._file.write(struct.pack("<2I", PAK_MAGIC, len(self._entries)) + self.header_extra)
+        self._file.write(records)
+        self._file.close()
+        self._file = None
+        if self._temp_path is not None:
+            os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        """Discards new archive. Archives opened with open() are closed with directory of entries added so far,
+        their data is already updated in place."""
+        if self._temp_path is None:
+            self.close()
+            return
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def repack(source: Path, destination: Path, replacements: Optional[Dict[str, Optional[EntrySource]]] = None,
+           alignment: int = PAK_ALIGNMENT):
+    """Writes compacted copy of archive. Replacement source of None removes entry, unknown names are added."""
+    replacements = replacements or {}
+    with Pak(source) as pak:
+        directory = pak.directory
+        names = [entry.name for entry in directory] + [name for name in replacements if name not in pak]
+        writer = PakWriter(destination, alignment, len(names), pak.header_extra)
+        try:
+            # Data is copied in source offset order so reads stay sequential
+            for entry in sorted(directory, key=lambda entry: entry.offset):
+                if entry.name not in replacements:
+                    writer.add(entry.name, pak.view(entry), entry.extra)
+            extras = {entry.name: entry.extra for entry in directory}
+            for name, replacement in replacements.items():
+                if replacement is not None:
+                    writer.add(name, replacement, extras.get(name))
+            writer.reorder(names)
+        except BaseException:
+            writer.abort()
+            raise
+    # Source mapping is released first, destination may replace it
+    writer.close()
+
+
+@dataclass
+class IndexedArchive:
+    path: str
+    mtime: float
+    size: int
+    # Full directory of the archive including names shadowed by later archives, name -> (offset, size)
+    entries: Dict[str, Tuple[int, int]] = field(default_factory=dict, repr=False)
+
+
+class PakIndex:
+    """Name index over many pak files stored on disk as JSON.
+
+    Archives are overlaid in given order, later archives replace entries of earlier ones. Archives that changed
+    since index was built are re-read on load.
+    """
+    VERSION = 2
+
+    def __init__(self, archives: List[IndexedArchive]):
+        self.archives = archives
+        self.entries: Dict[str, Tuple[int, int, int]] = {}
+        for archive_id, archive in enumerate(archives):
+            for name, (offset, size) in archive.entries.items():
+                self.entries[name] = (archive_id, offset, size)
+        self._name_index = NameIndex(self.entries)
+        self._paks: Dict[int, Pak] = {}
+
+    @staticmethod
+    def _read_archive(path: Path) -> IndexedArchive:
+        stat = path.stat()
+        with Pak(path) as pak:
+            entries = {entry.name: (entry.offset, entry.size) for entry in pak.entries()}
+        return IndexedArchive(str(path), stat.st_mtime, stat.st_size, entries)
+
+    @classmethod
+    def build(cls, paths: Iterable[Path], previous: Optional['PakIndex'] = None):
+        """Indexes archives, archives unchanged since previous index are not re-read."""
+        previous_archives = {}
+        if previous is not None:
+            previous_archives = {archive.path: archive for archive in previous.archives}
+        archives = []
+        for path in paths:
+            path = Path(path)
+            stat = path.stat()
+            archive = previous_archives.get(str(path))
+            if archive is None or (archive.mtime, archive.size) != (stat.st_mtime, stat.st_size):
+                archive = cls._read_archive(path)
+            archives.append(archive)
+        return cls(archives)
+
+    @classmethod
+    def load(cls, index_path: Path):
+        with open(index_path, "r", encoding="utf8") as f:
+            data = json.load(f)
+        if data.get("version") != cls.VERSION:
+            raise ValueError(f"Unsupported pak index version {data.get('version')}")
+        return cls([IndexedArchive(path, mtime, size, {name: tuple(entry) for name, entry in entries.items()})
+                    for path, mtime, size, entries in data["archives"]])
+
+    def save(self, index_path: Path):
+        data = {"version": self.VERSION,
+                "archives": [(archive.path, archive.mtime, archive.size, archive.entries)
+                             for archive in self.archives]}
+        BackgroundWriter.write_file(Path(index_path), json.dumps(data, separators=(",", ":")).encode("utf8"))
+
+    def is_stale(self) -> bool:
+        for archive in self.archives:
+            try:
+                stat = os.stat(archive.path)
+            except FileNotFoundError:
+                return True
+            if (stat.st_mtime, stat.st_size) != (archive.mtime, archive.size):
+                return True
+        return False
+
+    @classmethod
+    def from_directory(cls, root: Path, index_path: Optional[Path] = None):
+        """Opens overlay of all pak files under root, index is loaded from index_path and rebuilt when outdated."""
+        root = Path(root)
+        index_path = Path(index_path) if index_path is not None else root / "pak_index.json"
+        paths = sorted(root.rglob("*.pak"), key=lambda path: str(path).lower())
+        previous = None
+        if index_path.exists():
+            try:
+                previous = cls.load(index_path)
+            except (ValueError, KeyError, TypeError):
+                previous = None
+            if previous is not None and not previous.is_stale() and \
+                    [archive.path for archive in previous.archives] == [str(path) for path in paths]:
+                return previous
+        index = cls.build(paths, previous)
+        index.save(index_path)
+        return index
+
+    def archive(self, archive_id: int) -> Pak:
+        pak = self._paks.get(archive_id)
+        if pak is None:
+            archive_entries = {name: Entry(name, offset, size)
+                               for name, (offset, size) in self.archives[archive_id].entries.items()}
+            pak = self._paks[archive_id] = Pak(Path(self.archives[archive_id].path), archive_entries)
+        return pak
+
+    def find(self, name: str) -> Optional[Tuple[IndexedArchive, Entry]]:
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        archive_id, offset, size = entry
+        return self.archives[archive_id], Entry(name, offset, size)
+
+    def get(self, name: str) -> Optional[Buffer]:
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        return self.archive(entry[0]).get(name)
+
+    def glob(self, pattern: str):
+        for name in self._name_index.glob(pattern):
+            yield name, self.get(name)
+
+    def close(self):
+        for pak in self._paks.values():
+            pak.close()
+        self._paks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,171 @@
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import numpy as np
+
+from .nup import NupModel
+
+
+def transform_bboxes(bbox_min: np.ndarray, bbox_max: np.ndarray, matrices: np.ndarray):
+    """Transforms (N, 3) local boxes by (N, 4, 4) row-vector matrices, returns world space axis aligned boxes."""
+    corner_mask = ((np.arange(8)[:, None] >> np.arange(3)) & 1).astype(bool)
+    corners = np.where(corner_mask[None], bbox_max[:, None], bbox_min[:, None])
+    corners = np.einsum("nci,nij->ncj", corners, matrices[:, :3, :3]) + matrices[:, None, 3, :3]
+    return corners.min(axis=1), corners.max(axis=1)
+
+
+def frustum_planes(corners: np.ndarray) -> np.ndarray:
+    """Builds (6, 4) inward facing planes (nx, ny, nz, d) from 4 near and 4 far frustum corners.
+
+    Corners of each quad have to be in winding order, plane orientation is fixed using frustum centroid.
+    """
+    near, far = corners[:4], corners[4:]
+    triangles = [near[[0, 1, 2]], far[[0, 1, 2]]]
+    for i in range(4):
+        j = (i + 1) % 4
+        triangles.append(np.array([near[i], near[j], far[j]]))
+    triangles = np.asarray(triangles, np.float64)
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    normals /= np.linalg.norm(normals, axis=1, keepdims=True)
+    distances = -np.einsum("pi,pi->p", normals, triangles[:, 0])
+    centroid = corners.mean(axis=0)
+    flip = normals @ centroid + distances < 0
+    normals[flip] *= -1
+    distances[flip] *= -1
+    return np.column_stack([normals, distances])
+
+
+class SpatialIndex:
+    """Uniform grid over axis aligned instance bounds.
+
+    Every box is stored in all cells it overlaps, boxes overlapping more than max_cells cells (terrain, skyboxes)
+    are kept in separate list and tested by every query.
+    """
+
+    def __init__(self, bbox_min: np.ndarray, bbox_max: np.ndarray, items_per_cell: int = 8, max_cells: int = 64):
+        self.bbox_min = np.asarray(bbox_min, np.float32).reshape(-1, 3)
+        self.bbox_max = np.asarray(bbox_max, np.float32).reshape(-1, 3)
+        count = len(self.bbox_min)
+        if count:
+            self.origin = self.bbox_min.min(axis=0)
+            extent = np.maximum(self.bbox_max.max(axis=0) - self.origin, 1e-3)
+        else:
+            self.origin = np.zeros(3, np.float32)
+            extent = np.ones(3, np.float32)
+        cell_count = max(1, count // items_per_cell)
+        self.cell_size = np.maximum(np.cbrt(np.prod(extent) / cell_count), extent / 256).astype(np.float32)
+        self.dims = np.maximum(np.ceil(extent / self.cell_size).astype(np.int64), 1)
+
+        lo, hi = self._cell_range(self.bbox_min, self.bbox_max)
+        spans = hi - lo + 1
+        cells_per_item = np.prod(spans, axis=1)
+        large = cells_per_item > max_cells
+        self.large_items = np.flatnonzero(large)
+
+        items = np.flatnonzero(~large)
+        counts = cells_per_item[items]
+        item_ids = np.repeat(items, counts)
+        local = np.arange(len(item_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+        span_x, span_y = np.repeat(spans[items, 0], counts), np.repeat(spans[items, 1], counts)
+        cx = np.repeat(lo[items, 0], counts) + local % span_x
+        cy = np.repeat(lo[items, 1], counts) + (local // span_x) % span_y
+        cz = np.repeat(lo[items, 2], counts) + local // (span_x * span_y)
+        cell_ids = self._cell_id(cx, cy, cz)
+        order = np.argsort(cell_ids, kind="stable")
+        self.cell_items = item_ids[order]
+        self.cell_start = np.searchsorted(cell_ids[order], np.arange(np.prod(self.dims) + 1))
+
+    @classmethod
+    def from_nup(cls, nup: NupModel, **kwargs):
+        """Uses BNDS bounds, falls back to container bounds transformed by instance matrices."""
+        if nup.bnds:
+            bboxes = np.asarray(nup.bnds.bboxes, np.float32)[:, :, :3]
+            return cls(bboxes[:, 0], bboxes[:, 1], **kwargs)
+        containers = [nup.obj0[mesh_id & 0x000FFFFF] for mesh_id in nup.inst.mesh_id.tolist()]
+        bbox_min = np.asarray([container.bbox_min for container in containers], np.float32).reshape(-1, 3)
+        bbox_max = np.asarray([container.bbox_max for container in containers], np.float32).reshape(-1, 3)
+        return cls(*transform_bboxes(bbox_min, bbox_max, nup.inst.matrices), **kwargs)
+
+    def __len__(self):
+        return len(self.bbox_min)
+
+    def _cell_range(self, box_min: np.ndarray, box_max: np.ndarray):
+        lo = np.floor((box_min - self.origin) / self.cell_size).astype(np.int64)
+        hi = np.floor((box_max - self.origin) / self.cell_size).astype(np.int64)
+        return np.clip(lo, 0, self.dims - 1), np.clip(hi, 0, self.dims - 1)
+
+    def _cell_id(self, cx, cy, cz):
+        return (cz * self.dims[1] + cy) * self.dims[0] + cx
+
+    def _candidates(self, box_min: np.ndarray, box_max: np.ndarray) -> np.ndarray:
+        if not len(self):
+            return np.zeros(0, np.int64)
+        (x0, y0, z0), (x1, y1, z1) = self._cell_range(np.asarray(box_min), np.asarray(box_max))
+        cz, cy, cx = np.meshgrid(np.arange(z0, z1 + 1), np.arange(y0, y1 + 1), np.arange(x0, x1 + 1), indexing="ij")
+        cell_ids = self._cell_id(cx, cy, cz).ravel()
+        starts, ends = self.cell_start[cell_ids], self.cell_start[cell_ids + 1]
+        lengths = ends - starts
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        items = self.cell_items[np.repeat(starts, lengths) + offsets]
+        return np.unique(np.concatenate([items, self.large_items]))
+
+    def query_box(self, box_min, box_max) -> np.ndarray:
+        """Returns sorted ids of boxes overlapping query box."""
+        box_min = np.asarray(box_min, np.float32)
+        box_max = np.asarray(box_max, np.float32)
+        items = self._candidates(box_min, box_max)
+        overlap = np.all((self.bbox_min[items] <= box_max) & (self.bbox_max[items] >= box_min), axis=1)
+        return items[overlap]
+
+    def query_sphere(self, center, radius: float) -> np.ndarray:
+        """Returns sorted ids of boxes intersecting sphere."""
+        center = np.asarray(center, np.float32)
+        items = self._candidates(center - radius, center + radius)
+        closest = np.clip(center, self.bbox_min[items], self.bbox_max[items])
+        inside = np.einsum("ni,ni->n", closest - center, closest - center) <= radius * radius
+        return items[inside]
+
+    def query_frustum(self, planes: np.ndarray) -> np.ndarray:
+        """Returns sorted ids of boxes not fully outside of any of inward facing (K, 4) planes."""
+        planes = np.asarray(planes, np.float64)
+        inside = np.ones(len(self), bool)
+        for normal, distance in zip(planes[:, :3], planes[:, 3]):
+            positive_corner = np.where(normal >= 0, self.bbox_max, self.bbox_min)
+            inside &= positive_corner @ normal + distance >= 0
+        return np.flatnonzero(inside)
+
+
+@dataclass
+class BoxRegion:
+    box_min: np.ndarray
+    box_max: np.ndarray
+
+    def query(self, index: SpatialIndex) -> np.ndarray:
+        return index.query_box(self.box_min, self.box_max)
+
+
+@dataclass
+class SphereRegion:
+    center: np.ndarray
+    radius: float
+
+    def query(self, index: SpatialIndex) -> np.ndarray:
+        return index.query_sphere(self.center, self.radius)
+
+
+@dataclass
+class FrustumRegion:
+    planes: np.ndarray
+
+    def query(self, index: SpatialIndex) -> np.ndarray:
+        return index.query_frustum(self.planes)
+
+
+Region = Union[BoxRegion, SphereRegion, FrustumRegion]
+
+
+def select_instances(nup: NupModel, region: Optional[Region]) -> Optional[np.ndarray]:
+    """Returns ids of instances inside region, None when region is None."""
+    if region is None:
+        return None
+    return region.query(SpatialIndex.from_nup(nup))
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from .file_utils import BackgroundWriter
+
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+
+
+def default_cache_dir() -> Path:
+    if sys.platform == "win32":
+        root = Path(os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local"))
+    elif sys.platform == "darwin":
+        root = Path.home() / "Library" / "Caches"
+    else:
+        root = Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    return root / "BionicleHeroesTools" / "textures"
+
+
+def texture_digest(*chunks: bytes) -> str:
+    hasher = hashlib.blake2b(digest_size=16)
+    for chunk in chunks:
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class TextureCache:
+    """Content addressed texture files shared by all imports.
+
+    Files are named after the hash of their data, so identical textures from different levels and archives are
+    stored once. Every entry (single texture or all frames of a sequence) is a least recently used eviction unit,
+    file modification time is used as last access time.
+    """
+
+    def __init__(self, root: Optional[Path] = None, max_size: int = DEFAULT_MAX_SIZE):
+        self.root = Path(root) if root is not None else default_cache_dir()
+        self.max_size = max_size
+        self._used: Set[str] = set()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key: str, frame: Optional[int] = None) -> Path:
+        if frame is None:
+            return self.root / f"{key}.dds"
+        return self.root / f"{key}_{frame:04}.dds"
+
+    def _use(self, key: str, paths: List[Path], writer: Optional[BackgroundWriter], data: List[bytes]):
+        self._used.add(key)
+        for path, frame_data in zip(paths, data):
+            if writer is not None and writer.is_pending(path):
+                continue
+            if path.exists():
+                os.utime(path)
+            elif writer is not None:
+                writer.write(path, frame_data)
+            else:
+                BackgroundWriter.write_file(path, frame_data)
+
+    def store(self, data: bytes, writer: Optional[BackgroundWriter] = None,
+              key: Optional[str] = None) -> Tuple[str, Path]:
+        """Makes sure texture data is present in cache. Returns hash and file path."""
+        key = key or texture_digest(data)
+        path = self.path(key)
+        self._use(key, [path], writer, [data])
+        return key, path
+
+    def store_sequence(self, frames: List[bytes], writer: Optional[BackgroundWriter] = None) -> Tuple[str, Path]:
+        """Makes sure all frames of image sequence are present in cache. Returns hash and path of the first frame."""
+        key = texture_digest(len(frames).to_bytes(4, "little"), *frames)
+        paths = [self.path(key, n) for n in range(len(frames))]
+        self._use(key, paths, writer, frames)
+        return key, paths[0]
+
+    def evict(self):
+        """Removes least recently used entries until cache fits into max_size. Entries used by this cache are kept."""
+        entries: Dict[str, List[os.DirEntry]] = {}
+        total_size = 0
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if not entry.is_file() or not entry.name.endswith(".dds"):
+                    continue
+                key = entry.name[:-4].split("_")[0]
+                entries.setdefault(key, []).append(entry)
+                total_size += entry.stat().st_size
+        if total_size <= self.max_size:
+            return
+
+        def last_access(files: List[os.DirEntry]):
+            return max(file.stat().st_mtime for file in files)
+
+        for key, files in sorted(entries.items(), key=lambda item: last_access(item[1])):
+            if total_size <= self.max_size:
+                break
+            if key in self._used:
+                continue
+            for file in files:
+                try:
+                    size = file.stat().st_size
+                    os.remove(file.path)
+                    total_size -= size
+                except FileNotFoundError:
+                    pass
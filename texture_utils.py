@@ -0,0 +1,202 @@
+import struct
+import zlib
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .common import Schema
+from .nup import Texture
+
+DDS_HEADER_SCHEMA = Schema(
+    ("magic", "4s"), ("size", "I"), ("flags", "I"), ("height", "I"), ("width", "I"), ("pitch_or_linear_size", "I"),
+    ("depth", "I"), ("mip_count", "I"), ("reserved", "44x"),
+    ("pf_size", "I"), ("pf_flags", "I"), ("fourcc", "4s"), ("rgb_bit_count", "I"),
+    ("r_mask", "I"), ("g_mask", "I"), ("b_mask", "I"), ("a_mask", "I"),
+    ("caps", "I"), ("caps2", "I"), ("caps3", "I"), ("caps4", "I"), ("reserved2", "4x"),
+)
+
+DDPF_ALPHAPIXELS = 0x1
+DDPF_ALPHA = 0x2
+DDPF_FOURCC = 0x4
+DDPF_RGB = 0x40
+DDPF_LUMINANCE = 0x20000
+
+BC1_BLOCK_DTYPE = np.dtype([("color0", "<u2"), ("color1", "<u2"), ("indices", "<u4")])
+BC2_BLOCK_DTYPE = np.dtype([("alpha", "<u8"), ("color", BC1_BLOCK_DTYPE)])
+BC3_BLOCK_DTYPE = np.dtype([("alpha0", "u1"), ("alpha1", "u1"), ("alpha_indices", "u1", (6,)),
+                            ("color", BC1_BLOCK_DTYPE)])
+BLOCK_DTYPES = {b"DXT1": BC1_BLOCK_DTYPE, b"DXT2": BC2_BLOCK_DTYPE, b"DXT3": BC2_BLOCK_DTYPE,
+                b"DXT4": BC3_BLOCK_DTYPE, b"DXT5": BC3_BLOCK_DTYPE}
+
+
+def _unpack_565(colors: np.ndarray) -> np.ndarray:
+    colors = colors.astype(np.int32)
+    rgb = np.empty(colors.shape + (3,), np.int32)
+    rgb[..., 0] = ((colors >> 11) & 0x1F) * 255 // 31
+    rgb[..., 1] = ((colors >> 5) & 0x3F) * 255 // 63
+    rgb[..., 2] = (colors & 0x1F) * 255 // 31
+    return rgb
+
+
+def _decode_bc1_colors(blocks: np.ndarray, four_color_only: bool) -> np.ndarray:
+    """(N,) BC1 blocks -> (N, 16, 4) uint8 texels."""
+    color0 = _unpack_565(blocks["color0"])
+    color1 = _unpack_565(blocks["color1"])
+    four_color = (blocks["color0"] > blocks["color1"])[:, None]
+    if four_color_only:
+        four_color = np.ones_like(four_color)
+    palette = np.empty((len(blocks), 4, 4), np.int32)
+    palette[:, 0, :3] = color0
+    palette[:, 1, :3] = color1
+    palette[:, 2, :3] = np.where(four_color, (2 * color0 + color1) // 3, (color0 + color1) // 2)
+    palette[:, 3, :3] = np.where(four_color, (color0 + 2 * color1) // 3, 0)
+    palette[:, :3, 3] = 255
+    palette[:, 3, 3] = np.where(four_color[:, 0], 255, 0)
+    indices = (blocks["indices"][:, None] >> (2 * np.arange(16, dtype=np.uint32))) & 3
+    return np.take_along_axis(palette, indices[..., None].astype(np.intp), axis=1).astype(np.uint8)
+
+
+def _decode_bc2_alpha(blocks: np.ndarray) -> np.ndarray:
+    alpha = (blocks["alpha"][:, None] >> (4 * np.arange(16, dtype=np.uint64))) & 0xF
+    return (alpha * 17).astype(np.uint8)
+
+
+def _decode_bc3_alpha(blocks: np.ndarray) -> np.ndarray:
+    alpha0 = blocks["alpha0"].astype(np.int32)[:, None]
+    alpha1 = blocks["alpha1"].astype(np.int32)[:, None]
+    steps7 = np.arange(1, 7, dtype=np.int32)
+    steps5 = np.arange(1, 5, dtype=np.int32)
+    interp7 = ((7 - steps7) * alpha0 + steps7 * alpha1 + 3) // 7
+    interp5 = ((5 - steps5) * alpha0 + steps5 * alpha1 + 2) // 5
+    interp5 = np.concatenate([interp5, np.zeros_like(alpha0), np.full_like(alpha0, 255)], axis=1)
+    palette = np.empty((len(blocks), 8), np.int32)
+    palette[:, 0:1] = alpha0
+    palette[:, 1:2] = alpha1
+    palette[:, 2:] = np.where(alpha0 > alpha1, interp7, interp5)
+
+    packed = blocks["alpha_indices"].astype(np.uint64)
+    packed = (packed << (8 * np.arange(6, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    indices = (packed[:, None] >> (3 * np.arange(16, dtype=np.uint64))) & 7
+    return np.take_along_axis(palette, indices.astype(np.intp), axis=1).astype(np.uint8)
+
+
+def _blocks_to_image(texels: np.ndarray, blocks_y: int, blocks_x: int, width: int, height: int) -> np.ndarray:
+    image = texels.reshape(blocks_y, blocks_x, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return image.reshape(blocks_y * 4, blocks_x * 4, 4)[:height, :width]
+
+
+def decode_bcn(data, fourcc: bytes, width: int, height: int, offset: int = 0) -> np.ndarray:
+    """Decodes DXT1-5 data into (height, width, 4) uint8 RGBA array, all blocks at once."""
+    block_dtype = BLOCK_DTYPES[fourcc]
+    blocks_x, blocks_y = max(1, (width + 3) // 4), max(1, (height + 3) // 4)
+    blocks = np.frombuffer(data, block_dtype, blocks_x * blocks_y, offset)
+    if block_dtype is BC1_BLOCK_DTYPE:
+        texels = _decode_bc1_colors(blocks, False)
+    else:
+        texels = _decode_bc1_colors(blocks["color"], True)
+        if block_dtype is BC2_BLOCK_DTYPE:
+            texels[..., 3] = _decode_bc2_alpha(blocks)
+        else:
+            texels[..., 3] = _decode_bc3_alpha(blocks)
+    return _blocks_to_image(texels, blocks_y, blocks_x, width, height)
+
+
+def _expand_channel(pixels: np.ndarray, mask: int) -> Optional[np.ndarray]:
+    if not mask:
+        return None
+    shift = (mask & -mask).bit_length() - 1
+    max_value = mask >> shift
+    return (((pixels & mask) >> shift) * 255 // max_value).astype(np.uint8)
+
+
+def decode_uncompressed(data, bit_count: int, masks: Tuple[int, int, int, int], pf_flags: int,
+                        width: int, height: int, offset: int = 0) -> np.ndarray:
+    """Decodes mask described uncompressed pixels (RGBA, RGB, 565, 4444, 1555, L8, A8...) into RGBA array."""
+    pixel_size = bit_count // 8
+    raw = np.frombuffer(data, np.uint8, width * height * pixel_size, offset).reshape(-1, pixel_size)
+    pixels = np.zeros(len(raw), np.uint32)
+    for byte in range(pixel_size):
+        pixels |= raw[:, byte].astype(np.uint32) << (8 * byte)
+
+    bit_range = (1 << bit_count) - 1
+    r_mask, g_mask, b_mask, a_mask = (mask & bit_range for mask in masks)
+    if pf_flags & DDPF_LUMINANCE and not r_mask:
+        r_mask = bit_range
+    image = np.empty((width * height, 4), np.uint8)
+    if pf_flags & DDPF_ALPHA and not pf_flags & (DDPF_LUMINANCE | DDPF_RGB):
+        image[:, :3] = 255
+        image[:, 3] = _expand_channel(pixels, a_mask or r_mask)
+        return image.reshape(height, width, 4)
+    red = _expand_channel(pixels, r_mask)
+    image[:, 0] = red if red is not None else 0
+    if pf_flags & DDPF_LUMINANCE:
+        image[:, 1] = image[:, 0]
+        image[:, 2] = image[:, 0]
+    else:
+        for channel, mask in ((1, g_mask), (2, b_mask)):
+            value = _expand_channel(pixels, mask)
+            image[:, channel] = value if value is not None else 0
+    alpha = _expand_channel(pixels, a_mask) if pf_flags & DDPF_ALPHAPIXELS else None
+    image[:, 3] = alpha if alpha is not None else 255
+    return image.reshape(height, width, 4)
+
+
+def _mip_size(pf_flags: int, fourcc: bytes, bit_count: int, width: int, height: int) -> int:
+    if pf_flags & DDPF_FOURCC:
+        block_size = 8 if fourcc == b"DXT1" else 16
+        return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * block_size
+    return width * height * bit_count // 8
+
+
+def decode_dds(data, mip: int = 0, max_size: Optional[int] = None) -> np.ndarray:
+    """Decodes DDS file contents into (height, width, 4) uint8 RGBA array, top row first.
+
+    mip selects mip level, max_size selects the first mip level that fits into max_size x max_size instead.
+    """
+    header = DDS_HEADER_SCHEMA.unpack_from(data)
+    magic, _, _, height, width, _, _, mip_count, _, pf_flags, fourcc, bit_count, *masks = header[:16]
+    if magic != b"DDS ":
+        raise ValueError(f"Expected DDS data, got {magic!r}")
+    if pf_flags & DDPF_FOURCC and fourcc not in BLOCK_DTYPES:
+        raise NotImplementedError(f"Unsupported DDS pixel format {fourcc!r}")
+    mip_count = max(1, mip_count)
+    if max_size is not None:
+        mip = 0
+        while mip < mip_count - 1 and max(width >> mip, height >> mip) > max_size:
+            mip += 1
+    if not 0 <= mip < mip_count:
+        raise ValueError(f"Mip level {mip} is out of range, texture has {mip_count} levels")
+
+    offset = DDS_HEADER_SCHEMA.size
+    for level in range(mip):
+        offset += _mip_size(pf_flags, fourcc, bit_count, max(1, width >> level), max(1, height >> level))
+    width, height = max(1, width >> mip), max(1, height >> mip)
+
+    if pf_flags & DDPF_FOURCC:
+        return decode_bcn(data, fourcc, width, height, offset)
+    return decode_uncompressed(data, bit_count, tuple(masks), pf_flags, width, height, offset)
+
+
+def decode_texture(texture: Texture, mip: int = 0, max_size: Optional[int] = None) -> np.ndarray:
+    return decode_dds(texture.data, mip, max_size)
+
+
+def _png_chunk(name: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + name + data + struct.pack(">I", zlib.crc32(name + data) & 0xFFFFFFFF)
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """Encodes (height, width, 4) uint8 array into PNG file bytes."""
+    height, width, _ = rgba.shape
+    rows = np.zeros((height, 1 + width * 4), np.uint8)
+    rows[:, 1:] = rgba.reshape(height, width * 4)
+    return (b"\x89PNG\r\n\x1a\n" +
+            _png_chunk(b"IHDR", struct.pack(">2I5B", width, height, 8, 6, 0, 0, 0)) +
+            _png_chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)) +
+            _png_chunk(b"IEND", b""))
+
+
+def save_png(path: Path, rgba: np.ndarray):
+    with open(path, "wb") as f:
+        f.write(encode_png(rgba))